@@ -1,12 +1,10 @@
 import base64
 import json
-import math
 from enum import Enum, auto
 from typing import List, Optional, Tuple
 
 import colour
 import numpy as np
-import scipy.interpolate
 from bell.avr.mqtt.payloads import (
     AvrPcmFireLaserPayload,
     AvrPcmSetLaserOffPayload,
@@ -20,6 +18,7 @@ from PySide6 import QtCore, QtGui, QtWidgets
 from ..lib.calc import constrain, map_value
 from ..lib.color import wrap_text
 from ..lib.config import config
+from ..lib.thermal_interp import Upsampler
 from ..lib.widgets import DoubleLineEdit
 from .base import BaseTabWidget
 
@@ -63,16 +62,8 @@ class ThermalView(QtWidgets.QWidget):
         self.camera_y = self.camera_x
         self.camera_total = self.camera_x * self.camera_y
 
-        # create list of x/y points
-        self.points = [
-            (math.floor(ix / self.camera_x), (ix % self.camera_y))
-            for ix in range(self.camera_total)
-        ]
-        # i'm not fully sure what this does
-        self.grid_x, self.grid_y = np.mgrid[
-            0 : self.camera_x - 1 : self.camera_total / 2j,
-            0 : self.camera_y - 1 : self.camera_total / 2j,
-        ]
+        # cubic upsampling of the camera grid, weights are computed once here
+        self.upsampler = Upsampler(self.camera_x, self.camera_total // 2)
 
         # create avaiable colors
         self.colors = [
@@ -112,14 +103,8 @@ class ThermalView(QtWidgets.QWidget):
         # Rotate 90° to orient for mounting correctly
         float_pixels_matrix = np.reshape(float_pixels, (self.camera_x, self.camera_y))
         float_pixels_matrix = np.rot90(float_pixels_matrix, 1)
-        rotated_float_pixels = float_pixels_matrix.flatten()
 
-        bicubic = scipy.interpolate.griddata(
-            self.points,
-            rotated_float_pixels,
-            (self.grid_x, self.grid_y),
-            method="cubic",
-        )
+        bicubic = self.upsampler.upsample(float_pixels_matrix)
 
         pen = QtGui.QPen(QtCore.Qt.PenStyle.NoPen)
         self.canvas.clear()
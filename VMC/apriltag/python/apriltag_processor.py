@@ -1,5 +1,7 @@
 import math
+import os
 import subprocess
+import time
 import warnings
 from typing import List, Optional, Tuple
 
@@ -14,10 +16,29 @@ from bell.avr.mqtt.payloads import (
     AvrApriltagsVisibleTags,
     AvrApriltagsVisibleTagsPosWorld,
 )
+from loguru import logger
+from pose_estimator import fuse_tag_poses
+from tag_registry import TagRegistry, rigid_inverse, yaw_from_rotations
+from tag_tracker import TagTracker
 
 warnings.simplefilter("ignore", np.RankWarning)
 
 
+def relative_measures(
+    pos_rel: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Horizontal and vertical distances and angles (degrees [0, 360)) to the
+    tags at (N, 3) relative positions.
+    """
+    horizontal_distance = np.hypot(pos_rel[:, 0], pos_rel[:, 1])
+    vertical_distance = np.abs(pos_rel[:, 2])
+
+    angle = np.degrees(np.arctan2(pos_rel[:, 1], pos_rel[:, 0]))
+    angle = np.where(angle < 0.0, angle + 360.0, angle)
+    return horizontal_distance, vertical_distance, angle
+
+
 class AprilTagModule(MQTTModule):
     def __init__(self):
         super().__init__()
@@ -32,6 +53,21 @@ class AprilTagModule(MQTTModule):
                 ],  # cam x = body -y; cam y = body x, cam z = body z
             },
             "tag_truth": {"0": {"rpy": [0, 0, 0], "xyz": [0, 0, 0]}},
+            # more truth tags, loaded if the file exists
+            "tag_map": os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "tag_map.json"
+            ),
+            # noise model of the multi tag pose, cm + fraction of the tag distance,
+            # and how many deviations from the median make a tag an outlier
+            "pose": {"sigma": 2.0, "range_sigma": 0.02, "gate": 3.0},
+            # smoothing of pos_rel and pos_world over frames, a tag is published
+            # once seen in min_hits frames in a row
+            "tracker": {
+                "alpha": 0.5,
+                "beta": 0.1,
+                "timeout": 0.5,
+                "min_hits": 2,
+            },
         }
 
         # dict to hold transformation matrixes
@@ -39,6 +75,8 @@ class AprilTagModule(MQTTModule):
         # setup transformation matrixes
         self.setup_transforms()
 
+        self.tracker = TagTracker(**self.config["tracker"])
+
         self.topic_map = {"avr/apriltags/raw": self.on_apriltag_message}
 
     def setup_transforms(self) -> None:
@@ -57,35 +95,52 @@ class AprilTagModule(MQTTModule):
 
         self.tm["H_aeroBody_cam"] = H_aeroBody_cam
 
-        for tag, tag_data in self.config["tag_truth"].items():
-            name = f"tag_{tag}"
-            rmat = t3d.euler.euler2mat(
-                tag_data["rpy"][0], tag_data["rpy"][1], tag_data["rpy"][2], axes="rxyz"
-            )
-            tag_tf = t3d.affines.compose(tag_data["xyz"], rmat, [1, 1, 1])
+        # truth transforms of the tags, by tag id
+        self.tags = TagRegistry()
+        self.tags.update(self.config["tag_truth"])
 
-            H_to_from = f"H_{name}_aeroRef"
-            self.tm[H_to_from] = tag_tf
-
-            H_to_from = f"H_{name}_cam"
-            self.tm[H_to_from] = np.eye(4)
+        tag_map = self.config.get("tag_map")
+        if tag_map and os.path.isfile(tag_map):
+            count = self.tags.load(tag_map)
+            logger.info(f"Loaded {count} tags from {tag_map}")
 
     def on_apriltag_message(self, payload: AvrApriltagsRawPayload) -> None:
         tag_list: List[AvrApriltagsVisibleTags] = []
 
-        min_dist = 1000000
-        closest_tag = None
+        now = time.monotonic()
+        # indexes of the published tags seen from a known location
+        world_tags: List[int] = []
+
+        # all the tags in the message are computed together
+        (
+            ids,
+            horizontal_distances,
+            vertical_distances,
+            angles,
+            pos_worlds,
+            pos_rels,
+            headings,
+            world_headings,
+        ) = self.handle_tags(payload["tags"])
+
+        # smooth the positions over frames, tags not seen in enough frames in a row
+        # are left out
+        filtered, confirmed = self.tracker.update(
+            np.asarray(ids, dtype=np.int64), np.hstack((pos_rels, pos_worlds)), now
+        )
+        pos_rels, pos_worlds = filtered[:, :3], filtered[:, 3:]
+        horizontal_distances, vertical_distances, angles = relative_measures(pos_rels)
 
-        for index, tag in enumerate(payload["tags"]):
-            (
-                id_,
-                horizontal_distance,
-                vertical_distance,
-                angle,
-                pos_world,
-                pos_rel,
-                heading,
-            ) = self.handle_tag(tag)
+        for index, id_ in enumerate(ids):
+            if not confirmed[index]:
+                continue
+
+            horizontal_distance = horizontal_distances[index]
+            vertical_distance = vertical_distances[index]
+            angle = angles[index]
+            pos_world = pos_worlds[index]
+            pos_rel = pos_rels[index]
+            heading = headings[index]
 
             # weird special case (this shouldn't really happen though?)
             if id_ is None:
@@ -110,15 +165,13 @@ class AprilTagModule(MQTTModule):
             )
 
             # add some more info if we had the truth data for the tag
-            if pos_world is not None and pos_world.any():
+            if not np.isnan(pos_world).any() and pos_world.any():
                 tag["pos_world"] = AvrApriltagsVisibleTagsPosWorld(
                     x=pos_world[0],
                     y=pos_world[1],
                     z=pos_world[2],
                 )
-                if horizontal_distance < min_dist:
-                    min_dist = horizontal_distance
-                    closest_tag = index
+                world_tags.append(index)
 
             tag_list.append(tag)
 
@@ -126,47 +179,44 @@ class AprilTagModule(MQTTModule):
             "avr/apriltags/visible", AvrApriltagsVisiblePayload(tags=tag_list)
         )
 
-        if closest_tag is not None:
-            pos_world = tag_list[closest_tag]["pos_world"]
-
-            # this shouldn't happen
-            assert pos_world["x"] is not None
-            assert pos_world["y"] is not None
-            assert pos_world["z"] is not None
+        if world_tags:
+            # every tag with a known location votes for the drone pose
+            pose = fuse_tag_poses(
+                pos_worlds[world_tags],
+                world_headings[world_tags],
+                np.linalg.norm(pos_rels[world_tags], axis=1),
+                **self.config["pose"],
+            )
 
+            best = world_tags[pose.best]
             apriltag_position = AvrApriltagsSelectedPayload(
-                tag_id=tag_list[closest_tag]["id"],
+                tag_id=ids[best],
                 pos={
-                    "n": pos_world["x"],
-                    "e": pos_world["y"],
-                    "d": pos_world["z"],
+                    "n": pose.position[0],
+                    "e": pose.position[1],
+                    "d": pose.position[2],
                 },
-                heading=tag_list[closest_tag]["heading"],
+                # heading is still the one relative to the selected tag, the fused
+                # world heading goes in its own key
+                heading=headings[best],
             )
+            apriltag_position["world_heading"] = pose.heading  # type: ignore
+            # cm^2, n e d
+            apriltag_position["covariance"] = pose.covariance.tolist()  # type: ignore
 
             self.send_message("avr/apriltags/selected", apriltag_position)
 
-    def angle_to_tag(self, pos: Tuple[float, float, float]) -> float:
-        deg = math.degrees(
-            math.atan2(pos[1], pos[0])
-        )  # TODO - i think plus pi/2 bc this is respect to +x
-
-        if deg < 0.0:
-            deg += 360.0
-
-        return deg
-
     def world_angle_to_tag(
         self, pos: Tuple[float, float, float], tag_id: int
     ) -> Optional[float]:
         """
         returns the angle with respect to "north" in the "world frame"
         """
-        if str(tag_id) not in self.config["tag_truth"].keys():
+        if tag_id not in self.tags:
             return
 
-        del_x = self.config["tag_truth"][str(tag_id)]["xyz"][0] - pos[0]
-        del_y = self.config["tag_truth"][str(tag_id)]["xyz"][1] - pos[1]
+        del_x = self.tags.xyz[tag_id][0] - pos[0]
+        del_y = self.tags.xyz[tag_id][1] - pos[1]
         deg = math.degrees(
             math.atan2(del_y, del_x)
         )  # TODO - i think plus pi/2 bc this is respect to +x
@@ -176,105 +226,73 @@ class AprilTagModule(MQTTModule):
 
         return deg
 
-    def H_inv(self, H: np.ndarray) -> np.ndarray:
-        """
-        A method to efficiently compute the inverse of a homogeneous transformation
-        matrix. Reference: http://vr.cs.uiuc.edu/node81.html
-        """
-
-        T, R, Z, S = t3d.affines.decompose44(H)
-
-        R_t = np.transpose(R)
-        H_rot = t3d.affines.compose(
-            [0, 0, 0],
-            R_t,
-            [1, 1, 1],
-        )
-        H_tran = t3d.affines.compose(
-            [-1 * T[0], -1 * T[1], -1 * T[2]],
-            np.eye(3),
-            [1, 1, 1],
-        )
-
-        return H_rot.dot(H_tran)
-
-    def handle_tag(
-        self, tag: AvrApriltagsRawTags
+    def handle_tags(
+        self, tags: List[AvrApriltagsRawTags]
     ) -> Tuple[
-        int,
-        float,
-        float,
-        float,
-        Optional[np.ndarray],
-        Tuple[float, float, float],
-        float,
+        List[int],
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
     ]:
         """
         Calculates the distance, position, and heading of the drone in NED frame
-        based on the tag detections.
+        from all the tags of one message at once, stacked into (N, 4, 4)
+        transforms. Returns the ids, then arrays of the horizontal
+        and vertical distances, angles to the tags, (N, 3) world positions
+        (NaN rows for tags without truth data), (N, 3) relative positions,
+        headings and world headings (NaN without truth data).
         """
+        ids = [tag["id"] for tag in tags]
+        n = len(ids)
+        id_array = np.asarray(ids, dtype=np.int64).reshape(n)
 
-        tag_id = tag["id"]
-
-        tag_rot = np.asarray(tag["rotation"])
-        rpy = t3d.euler.mat2euler(tag_rot)
-        R = t3d.euler.euler2mat(0, 0, rpy[2], axes="rxyz")
-        H_tag_cam = t3d.affines.compose(
-            [tag["pos"]["x"] * 100, tag["pos"]["y"] * 100, tag["pos"]["z"] * 100],
-            R,
-            [1, 1, 1],
+        tag_rot = np.asarray([tag["rotation"] for tag in tags], dtype=float).reshape(
+            n, 3, 3
+        )
+        tag_pos = np.asarray(
+            [[tag["pos"]["x"], tag["pos"]["y"], tag["pos"]["z"]] for tag in tags],
+            dtype=float,
+        ).reshape(n, 3)
+
+        # only the yaw of the tag is kept
+        yaw = yaw_from_rotations(tag_rot)
+        cos, sin = np.cos(yaw), np.sin(yaw)
+        H_tag_cam = np.zeros((n, 4, 4))
+        H_tag_cam[:, 0, 0] = cos
+        H_tag_cam[:, 0, 1] = -sin
+        H_tag_cam[:, 1, 0] = sin
+        H_tag_cam[:, 1, 1] = cos
+        H_tag_cam[:, 2, 2] = 1
+        H_tag_cam[:, :3, 3] = tag_pos * 100
+        H_tag_cam[:, 3, 3] = 1
+
+        H_cam_tag = rigid_inverse(H_tag_cam)
+        H_aerobody_tag = H_cam_tag @ self.tm["H_aeroBody_cam"]
+
+        pos_rel = H_aerobody_tag[:, :3, 3]
+        horizontal_distance, vertical_distance, angle = relative_measures(pos_rel)
+
+        heading = yaw_from_rotations(H_aerobody_tag[:, :3, :3])
+        heading = np.rad2deg(np.where(heading < 0, heading + 2 * math.pi, heading))
+
+        # for the tags we have a location definition for
+        pos_world, world_heading = self.tags.world_poses(id_array, H_aerobody_tag)
+        world_heading = np.rad2deg(np.mod(world_heading, 2 * math.pi))
+
+        return (
+            ids,
+            horizontal_distance,
+            vertical_distance,
+            angle,
+            pos_world,
+            pos_rel,
+            heading,
+            world_heading,
         )
-        T, R, Z, S = t3d.affines.decompose44(H_tag_cam)
-
-        name = f"tag_{tag_id}"
-        H_to_from = f"H_{name}_cam"
-        self.tm[H_to_from] = H_tag_cam
-
-        # H_cam_tag = np.linalg.inv(H_tag_cam)
-        H_cam_tag = self.H_inv(H_tag_cam)
-
-        H_aerobody_tag = H_cam_tag.dot(self.tm["H_aeroBody_cam"])
-
-        T2, R2, Z2, S2 = t3d.affines.decompose44(H_aerobody_tag)
-        rpy = t3d.euler.mat2euler(R2)
-        pos_rel: Tuple[float, float, float] = T2  # type: ignore
-
-        horizontal_distance: float = np.linalg.norm([pos_rel[0], pos_rel[1]])  # type: ignore
-        vertical_distance = abs(pos_rel[2])
-
-        heading = rpy[2]
-        if heading < 0:
-            heading += 2 * math.pi
-
-        heading: float = np.rad2deg(heading)
-        angle = self.angle_to_tag(pos_rel)  # type: ignore
-
-        # if we have a location definition for the visible tag
-        if str(tag["id"]) in self.config["tag_truth"].keys():
-            H_cam_aeroRef = self.tm[f"H_{name}_aeroRef"].dot(H_cam_tag)
-            H_aeroBody_aeroRef = H_cam_aeroRef.dot(self.tm["H_aeroBody_cam"])
-
-            pos_world, R, Z, S = t3d.affines.decompose44(H_aeroBody_aeroRef)
-
-            return (
-                tag_id,
-                horizontal_distance,
-                vertical_distance,
-                angle,
-                pos_world,
-                pos_rel,
-                heading,
-            )
-        else:
-            return (
-                tag_id,
-                horizontal_distance,
-                vertical_distance,
-                angle,
-                None,
-                pos_rel,
-                heading,
-            )
 
     def run(self) -> None:
         subprocess.Popen("/app/c/build/avrapriltags")
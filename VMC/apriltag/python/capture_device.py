@@ -1,6 +1,7 @@
 from typing import Optional, Tuple
 
 import cv2
+import numpy as np
 from bell.avr.utils.decorators import run_forever
 from loguru import logger
 
@@ -66,6 +67,24 @@ class CaptureDevice:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         return ret, img  #  type:ignore
 
+    def read_gray_into(self, dst: np.ndarray) -> bool:
+        """
+        Reads a grayscale frame straight into dst, like a shared memory slot.
+        Returns False, dropping the frame, if the read failed or the frame is not
+        the size of dst.
+        """
+        ret, img = self.cv.read()
+        if not ret:
+            return False
+        if img.shape[:2] != dst.shape:
+            logger.warning(f"Frame is {img.shape[:2]}, expected {dst.shape}. Dropped")
+            return False
+        out = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=dst)
+        # opencv writes into dst when it fits, copy in case it made its own
+        if out is not dst:
+            np.copyto(dst, out)
+        return True
+
     @run_forever(frequency=100)
     def run(self) -> None:
         # try to read frame
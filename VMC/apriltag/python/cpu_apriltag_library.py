@@ -5,6 +5,7 @@ from typing import List, Optional, Tuple
 import numpy as np
 from bell.avr.utils.decorators import try_except
 from capture_device import CaptureDevice
+from frame_ring import SharedFrameRing
 from loguru import logger
 from pupil_apriltags import Detection, Detector
 
@@ -57,8 +58,17 @@ class AprilTagVPS:
         # pupil april tags wrapper
         self.atag = AprilTagWrapper(camera_params=camera_params, tag_size=tag_size)
 
-        # setup processing queue
-        self.img_queue = multiprocessing.Queue()
+        # number of perception processes
+        self.workers = 2
+        # most frames waiting for perception
+        self.max_depth = 3
+        # frames older than this (seconds) when a worker gets to them are skipped
+        self.max_frame_age = 0.5
+
+        # frames go through shared memory slots, one per waiting or processing frame
+        self.frames = SharedFrameRing(
+            (res[1], res[0]), slots=self.max_depth + self.workers
+        )
         self.tags_queue = multiprocessing.Queue()
 
         self.tags = None
@@ -76,8 +86,8 @@ class AprilTagVPS:
         a v4l2 camera @ 'video_device' and uses 'camera_params' along with
         'tag_size' to calculate pose.
         """
-        # we will setup 2 processing consumers for the imagery.
-        for i in range(2):
+        # we will setup processing consumers for the imagery.
+        for i in range(self.workers):
             proc = multiprocessing.Process(
                 target=self.perception_loop, args=[], daemon=True  # type: ignore
             )
@@ -91,69 +101,88 @@ class AprilTagVPS:
         delta_buckets = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         i = 0
 
-        while True:
-            # if the perception loop has completed analysis on a frame,
-            # show some stats or even render the frame
-            if self.tags_queue.empty():
-                time.sleep(0.01)
-                continue
-
-            self.num_images += 1
-            now = time.time()
-
-            # try to get a tag from the queue
-            tags = self.tags_queue.get()
-            if tags:
-                self.tags = tags
-                self.tags_timestamp = now
-            else:
-                self.tags = []
-
-            # calculate the framerate
-            tdelta = now - last_loop
-            delta_buckets[i % 10] = tdelta  # type: ignore
-            self.avg = 1 / (sum(delta_buckets) / 10)
-            last_loop = now
-            i += 1
+        try:
+            while True:
+                # if the perception loop has completed analysis on a frame,
+                # show some stats or even render the frame
+                if self.tags_queue.empty():
+                    time.sleep(0.01)
+                    continue
+
+                self.num_images += 1
+                now = time.time()
+
+                # try to get a tag from the queue
+                tags = self.tags_queue.get()
+                if tags:
+                    self.tags = tags
+                    self.tags_timestamp = now
+                else:
+                    self.tags = []
+
+                # calculate the framerate
+                tdelta = now - last_loop
+                delta_buckets[i % 10] = tdelta  # type: ignore
+                self.avg = 1 / (sum(delta_buckets) / 10)
+                last_loop = now
+                i += 1
+        finally:
+            self.frames.close()
 
     def capture_loop(self) -> None:
         """
-        Captures frames from the camera and places them into the image queue
-        to be consumed downstream by "perception loop". Checks to make sure queue
-        is not being overloaded and limits queue size to "max_depth".
+        Captures frames from the camera straight into free shared memory slots and
+        hands the slots to be consumed downstream by "perception loop". When all
+        the slots are in use ("max_depth" frames waiting), frames are dropped.
         """
-        max_depth = 3
         capture = CaptureDevice(
             self.protocol, self.video_device, self.res, self.framerate
         )
+        sequence = 0
 
         logger.success("Capture loop started!")
 
         while True:
-            ret, img = capture.read_gray()
-
-            # if theres room in the queue and we have a valid image
-            if (self.img_queue.qsize() < max_depth) and (ret is True):
-                # put the image in the queue
-                self.img_queue.put(img)
+            slot = self.frames.acquire()
+
+            if slot is None:
+                # perception is behind, keep reading so the frames don't go stale
+                capture.read()
+            elif capture.read_gray_into(self.frames.frame(slot)):
+                self.frames.publish(slot, sequence)
+                sequence += 1
+            else:
+                self.frames.release(slot)
 
             time.sleep(0.01)
 
     @try_except(reraise=True)
     def perception_loop(self) -> None:
         """
-        Pulls images off the image queue, hands them to the apriltag detector,
-        and then places the results in the tags queue.
+        Takes frames handed over by the capture loop, runs the apriltag detector on
+        them in place in shared memory, and then places the results in the tags
+        queue.
         """
         logger.success("Perception loop started!")
 
         while True:
-            if not self.img_queue.empty():
-                img = self.img_queue.get()
-                tags = self.atag.process_image(img)
-                self.tags_queue.put(tags)
-            else:
-                time.sleep(0.01)
+            frame = self.frames.take(timeout=0.1)
+            if frame is None:
+                continue
+
+            slot, sequence, timestamp = frame
+            age = time.time() - timestamp
+            if age > self.max_frame_age:
+                # detections this late are no use for position, skip to a newer frame
+                self.frames.release(slot)
+                logger.debug(f"Skipped frame {sequence}, {age:.2f} s old")
+                continue
+
+            try:
+                tags = self.atag.process_image(self.frames.frame(slot))
+            finally:
+                self.frames.release(slot)
+            self.tags_queue.put(tags)
 
 
 if __name__ == "__main__":
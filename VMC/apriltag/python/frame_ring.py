@@ -0,0 +1,80 @@
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class SharedFrameRing:
+    """
+    Preallocated frame slots in shared memory, handed between processes by
+    index. A slot is free, being written by the capture process, waiting for
+    perception or being read by a perception worker. Only (slot, sequence,
+    timestamp) tuples go through the queues, the frames are never pickled or
+    copied.
+    """
+
+    def __init__(
+        self, shape: Tuple[int, ...], slots: int, dtype: type = np.uint8
+    ) -> None:
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.frame_bytes * slots
+        )
+
+        self.free = multiprocessing.Queue()
+        self.ready = multiprocessing.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def frame(self, slot: int) -> np.ndarray:
+        """
+        The frame in slot, a view into the shared memory.
+        """
+        return np.ndarray(
+            self.shape,
+            dtype=self.dtype,
+            buffer=self.shm.buf,
+            offset=slot * self.frame_bytes,
+        )
+
+    def acquire(self) -> Optional[int]:
+        """
+        A free slot to write a frame into, or None if they are all in use.
+        """
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def publish(self, slot: int, sequence: int) -> None:
+        """
+        Hands a written slot to perception.
+        """
+        self.ready.put((slot, sequence, time.time()))
+
+    def take(self, timeout: float) -> Optional[Tuple[int, int, float]]:
+        """
+        (slot, sequence, timestamp) of the next frame to process, or None if
+        none came within timeout seconds. The slot must be released after.
+        """
+        try:
+            return self.ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int) -> None:
+        self.free.put(slot)
+
+    def close(self) -> None:
+        """
+        Frees the shared memory, called by the process that made the ring.
+        """
+        self.shm.close()
+        self.shm.unlink()
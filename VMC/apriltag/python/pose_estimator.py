@@ -0,0 +1,71 @@
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+
+class FusedPose(NamedTuple):
+    # index into the inputs of the tag with the most weight
+    best: int
+    position: np.ndarray
+    # degrees [0, 360)
+    heading: float
+    # (3, 3) of the position, cm^2
+    covariance: np.ndarray
+    inliers: np.ndarray
+
+
+def fuse_tag_poses(
+    positions: np.ndarray,
+    headings: np.ndarray,
+    distances: np.ndarray,
+    sigma: float = 2.0,
+    range_sigma: float = 0.02,
+    gate: float = 3.0,
+) -> FusedPose:
+    """
+    Fuses the drone poses seen from each truth tag of a frame into one.
+
+    positions are (N, 3) world positions in cm, headings the matching world
+    headings in degrees and distances how far each tag is. Each tag is assumed
+    to be off by sigma + range_sigma * distance (cm, 1 standard deviation).
+    Tags further than gate deviations from the median are outliers, the rest
+    are averaged with inverse variance weights, the weighted least squares
+    solution. The covariance is the noise model's plus the spread of the
+    inliers, so disagreeing tags widen it. When no tags agree, the most
+    accurate one is used and the spread of all the tags around it is added.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    std = sigma + range_sigma * np.asarray(distances, dtype=float)
+    weights = 1 / std**2
+
+    residuals = np.linalg.norm(positions - np.median(positions, axis=0), axis=1)
+    inliers = residuals <= gate * std
+    agreed = bool(inliers.any())
+    if not agreed:
+        # nothing agrees, trust the most accurate tag alone
+        inliers = weights == weights.max()
+
+    w = weights[inliers]
+    total = w.sum()
+    position = w @ positions[inliers] / total
+
+    covariance = np.eye(3) / total
+    count = int(inliers.sum())
+    if count > 1:
+        deltas = positions[inliers] - position
+        spread = np.einsum("n,ni,nj->ij", w, deltas, deltas) / total
+        covariance += spread / (count - 1)
+    if not agreed:
+        # the other tags say it could be anywhere among them
+        deltas = positions - position
+        covariance += np.einsum("n,ni,nj->ij", weights, deltas, deltas) / weights.sum()
+
+    # circular mean so 359 and 1 average to 0
+    radians = np.deg2rad(np.asarray(headings, dtype=float)[inliers])
+    heading = math.degrees(math.atan2(w @ np.sin(radians), w @ np.cos(radians)))
+    if heading < 0.0:
+        heading += 360.0
+
+    best = int(np.flatnonzero(inliers)[np.argmax(w)])
+    return FusedPose(best, position, heading, covariance, inliers)
@@ -0,0 +1,124 @@
+import json
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+import transforms3d as t3d
+
+# below this, t3d.euler.mat2euler treats a rotation as gimbal locked
+EPS4 = np.finfo(float).eps * 4.0
+
+
+def yaw_from_rotations(R: np.ndarray) -> np.ndarray:
+    """
+    Batched z angle of t3d.euler.mat2euler (static xyz axes) for (N, 3, 3)
+    rotation matrices.
+    """
+    cy = np.sqrt(R[:, 0, 0] * R[:, 0, 0] + R[:, 1, 0] * R[:, 1, 0])
+    return np.where(cy > EPS4, np.arctan2(R[:, 1, 0], R[:, 0, 0]), 0.0)
+
+
+def rigid_inverse(H: np.ndarray) -> np.ndarray:
+    """
+    Inverse of (..., 4, 4) rigid homogeneous transforms, [R^T, -R^T T].
+    Reference: http://vr.cs.uiuc.edu/node81.html
+    """
+    R_t = np.swapaxes(H[..., :3, :3], -1, -2)
+    inverse = np.zeros_like(H)
+    inverse[..., :3, :3] = R_t
+    inverse[..., :3, 3] = -np.einsum("...ij,...j->...i", R_t, H[..., :3, 3])
+    inverse[..., 3, 3] = 1
+    return inverse
+
+
+class TagRegistry:
+    """
+    Truth transforms of the tags with known locations, in arrays indexed by
+    the integer tag id so a whole message is looked up with one fancy index.
+    """
+
+    def __init__(self, capacity: int = 587) -> None:
+        # tag36h11 has ids 0 to 586, grown if a larger id is added
+        self.known = np.zeros(capacity, dtype=bool)
+        self.xyz = np.zeros((capacity, 3))
+        # tag -> aeroRef
+        self.H_tag_aeroRef = np.tile(np.eye(4), (capacity, 1, 1))
+
+    def __contains__(self, tag_id: int) -> bool:
+        return 0 <= tag_id < len(self.known) and bool(self.known[tag_id])
+
+    def __len__(self) -> int:
+        return int(self.known.sum())
+
+    def grow(self, capacity: int) -> None:
+        extra = capacity - len(self.known)
+        if extra <= 0:
+            return
+        identities = np.tile(np.eye(4), (extra, 1, 1))
+        self.known = np.concatenate((self.known, np.zeros(extra, dtype=bool)))
+        self.xyz = np.concatenate((self.xyz, np.zeros((extra, 3))))
+        self.H_tag_aeroRef = np.concatenate((self.H_tag_aeroRef, identities))
+
+    def add(self, tag_id: int, xyz: Sequence[float], rpy: Sequence[float]) -> None:
+        """
+        Sets the truth location of a tag, xyz in cm and rpy in radians
+        (rotating x, y, z axes) in the aeroRef frame.
+        """
+        if tag_id < 0:
+            raise ValueError(f"Invalid tag id {tag_id}")
+        self.grow(tag_id + 1)
+        rmat = t3d.euler.euler2mat(rpy[0], rpy[1], rpy[2], axes="rxyz")
+        H = t3d.affines.compose(xyz, rmat, [1, 1, 1])
+        self.known[tag_id] = True
+        self.xyz[tag_id] = xyz
+        self.H_tag_aeroRef[tag_id] = H
+
+    def update(self, tag_truth: Dict[str, dict]) -> None:
+        """
+        Adds tags from a {"id": {"rpy": [...], "xyz": [...]}} mapping, the
+        format of the "tag_truth" config.
+        """
+        for tag_id, tag_data in tag_truth.items():
+            self.add(int(tag_id), tag_data["xyz"], tag_data["rpy"])
+
+    def load(self, path: str) -> int:
+        """
+        Adds the tags of a JSON tag map, either in the "tag_truth" format or a
+        list of {"id", "xyz", "rpy"} objects. Returns how many tags were read.
+        """
+        with open(path) as f:
+            tag_map: Union[Dict[str, dict], List[dict]] = json.load(f)
+
+        if isinstance(tag_map, dict):
+            self.update(tag_map)
+            return len(tag_map)
+
+        for tag_data in tag_map:
+            self.add(int(tag_data["id"]), tag_data["xyz"], tag_data["rpy"])
+        return len(tag_map)
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Mask of the ids that have truth data.
+        """
+        in_range = (ids >= 0) & (ids < len(self.known))
+        mask = np.zeros(len(ids), dtype=bool)
+        mask[in_range] = self.known[ids[in_range]]
+        return mask
+
+    def world_poses(
+        self, ids: np.ndarray, H_aerobody_tag: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (N, 3) positions and (N,) yaws (radians) in the aeroRef frame of the
+        aeroBody poses in H_aerobody_tag, NaN for the tags without truth data.
+        """
+        known = self.lookup(ids)
+        positions = np.full((len(ids), 3), np.nan)
+        yaws = np.full(len(ids), np.nan)
+        H = self.H_tag_aeroRef[ids[known]]
+        positions[known] = (
+            np.einsum("nij,nj->ni", H[:, :3, :3], H_aerobody_tag[known, :3, 3])
+            + H[:, :3, 3]
+        )
+        yaws[known] = yaw_from_rotations(H[:, :3, :3] @ H_aerobody_tag[known, :3, :3])
+        return positions, yaws
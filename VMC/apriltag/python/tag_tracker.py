@@ -0,0 +1,95 @@
+from threading import Lock
+from typing import Tuple
+
+import numpy as np
+
+
+class TagTracker:
+    """
+    Constant velocity (alpha-beta) filter per tag id, smoothing the tag
+    positions between frames.
+
+    All the state is in preallocated arrays indexed by tag id. A tag must be
+    seen min_hits times in a row before it is confirmed, and a track not
+    updated for timeout seconds starts over, so one frame detections never get
+    through.
+    """
+
+    def __init__(
+        self,
+        size: int = 6,
+        capacity: int = 587,
+        alpha: float = 0.5,
+        beta: float = 0.1,
+        timeout: float = 0.5,
+        min_hits: int = 2,
+    ) -> None:
+        """
+        size is the length of the tracked vector of each tag. alpha and beta
+        are the position and velocity gains, 1 and 1 follow the measurements
+        exactly.
+        """
+        self.size = size
+        self.alpha = alpha
+        self.beta = beta
+        self.timeout = timeout
+        self.min_hits = min_hits
+        self.lock = Lock()
+
+        self.state = np.zeros((capacity, size))
+        self.velocity = np.zeros((capacity, size))
+        self.stamp = np.full(capacity, -np.inf)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+
+    def grow(self, capacity: int) -> None:
+        extra = capacity - len(self.stamp)
+        if extra <= 0:
+            return
+        self.state = np.concatenate((self.state, np.zeros((extra, self.size))))
+        self.velocity = np.concatenate((self.velocity, np.zeros((extra, self.size))))
+        self.stamp = np.concatenate((self.stamp, np.full(extra, -np.inf)))
+        self.hits = np.concatenate((self.hits, np.zeros(extra, dtype=np.int64)))
+
+    def update(
+        self, ids: np.ndarray, measurements: np.ndarray, now: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Adds the (N, size) measurements of the tags ids seen at now (seconds).
+        Returns the (N, size) filtered values and the mask of confirmed tracks.
+        Repeated ids in one frame keep the last one.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        measurements = np.asarray(measurements, dtype=float).reshape(-1, self.size)
+        if len(ids) and ids.min() < 0:
+            raise ValueError(f"Invalid tag id {ids.min()}")
+
+        with self.lock:
+            if len(ids):
+                self.grow(int(ids.max()) + 1)
+
+            dt = now - self.stamp[ids]
+            fresh = (dt > self.timeout) | (dt <= 0)
+            dt = np.where(fresh, 1.0, dt)[:, None]
+
+            # predict, then correct by the residual
+            predicted = self.state[ids] + self.velocity[ids] * dt
+            residual = measurements - predicted
+            state = predicted + self.alpha * residual
+            velocity = self.velocity[ids] + self.beta * residual / dt
+            # the second measurement has no velocity to correct yet, take the step
+            seeded = (self.hits[ids] == 1) & ~fresh
+            velocity[seeded] = residual[seeded] / dt[seeded]
+            state[fresh] = measurements[fresh]
+            velocity[fresh] = 0
+            # missing (NaN) values just follow the measurements
+            missing = np.isnan(state) | np.isnan(velocity)
+            state[missing] = measurements[missing]
+            velocity[missing] = 0
+
+            hits = np.where(fresh, 1, self.hits[ids] + 1)
+            self.state[ids] = state
+            self.velocity[ids] = velocity
+            self.stamp[ids] = now
+            self.hits[ids] = hits
+
+            return state, hits >= self.min_hits
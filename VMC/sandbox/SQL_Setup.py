@@ -1,4 +1,5 @@
 import sqlite3, pathlib, os
+import hazard_store
 
 HAZARD_LIST = [
     ((231, 82, 0), 14, (0, 0, 32)), # Fire Rescue Building
@@ -26,19 +27,16 @@ db_file = 'database.db'
 if not check_db(db_file):
     with sqlite3.connect(db_file) as conn:
         c = conn.cursor()
-        c.execute("""CREATE TABLE hazards (
-                              position,
-                              radius,
-                              height_vec
-                              )""")
         c.execute("""CREATE TABLE path_nodes (
                               position,
                               blocked
                               ) """)
         c.execute("""CREATE TABLE log_num (
                             num) """)
-        for hazard in HAZARD_LIST:
-            c.execute(f"INSERT INTO hazards VALUES ('{hazard[0]}', {hazard[1]}, '{hazard[2]}')")
         c.execute("""INSERT INTO log_num VALUES (171)""")
         conn.commit()
+    hazard_store.open_store(db_file).write(HAZARD_LIST)
+else:
+    # Moves the hazards out of the old string table, if it is still there
+    hazard_store.open_store(db_file).migrate()
         
@@ -0,0 +1,138 @@
+import argparse, json, sys, tempfile, time, tracemalloc
+import numpy as np
+from collision_avoidance import collision_dectector
+import voxelizer
+
+# (name, field dimensions(inches), hazards)
+CONFIGS = [
+    ('field sparse', (472, 170, 200), 6),
+    ('field', (472, 170, 200), 13),
+    ('field dense', (472, 170, 200), 30),
+    ('double field', (944, 340, 200), 26),
+    ('double field dense', (944, 340, 200), 60),
+]
+AVR_rad = 17.3622
+
+def random_hazards(rng: np.random.Generator, field_dimensions: tuple, count: int) -> list:
+    """ Towers standing on the ground, with every fifth hazard a horizontal bar like the ones on the field. """
+    length, width, height = field_dimensions
+    hazards = []
+    for i in range(count):
+        radius = float(rng.uniform(4, 18))
+        if i % 5 == 4:
+            bar_length = float(rng.uniform(30, 60))
+            if rng.random() < 0.5:
+                center = (float(rng.uniform(0, length - bar_length)), float(rng.uniform(0, width)), float(rng.uniform(30, height/2)))
+                vec = (bar_length, 0.0, 0.0)
+            else:
+                center = (float(rng.uniform(0, length)), float(rng.uniform(0, width - bar_length)), float(rng.uniform(30, height/2)))
+                vec = (0.0, bar_length, 0.0)
+        else:
+            center = (float(rng.uniform(0, length)), float(rng.uniform(0, width)), 0.0)
+            vec = (0.0, 0.0, float(rng.uniform(24, height*0.6)))
+        hazards.append((center, radius, vec))
+    return hazards
+
+def random_positions(rng: np.random.Generator, field_dimensions: tuple, count: int) -> np.ndarray:
+    return rng.uniform(AVR_rad, np.array(field_dimensions) - AVR_rad, (count, 3))
+
+def free_positions(rng: np.random.Generator, col_test: collision_dectector, count: int) -> list:
+    """ Random positions the drone can be at, the field has to have some free space. """
+    positions = []
+    while len(positions) < count:
+        pos = tuple(random_positions(rng, tuple(col_test.field_dimensions), 1)[0].tolist())
+        if col_test.clearance(pos) >= col_test.AVR_rad and not col_test.occupancy[col_test.pos_to_node(pos)[::-1]]:
+            positions.append(pos)
+    return positions
+
+def timed(call, *args) -> float:
+    start = time.perf_counter()
+    call(*args)
+    return time.perf_counter() - start
+
+def peak_memory(call, *args) -> int:
+    """ Peak bytes allocated by Python and NumPy while running call. Run separately since tracing slows things down. """
+    tracemalloc.start()
+    try:
+        call(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def summary(times: list, expanded: list = None, memory: int = 0) -> dict:
+    times = np.array(times)*1000
+    result = {'calls': len(times), 'p50_ms': float(np.percentile(times, 50)), 'p99_ms': float(np.percentile(times, 99)), 'peak_kb': memory/1024}
+    if expanded is not None:
+        result['expanded_p50'] = float(np.percentile(expanded, 50))
+        result['expanded_p99'] = float(np.percentile(expanded, 99))
+    return result
+
+def run_config(name: str, field_dimensions: tuple, hazard_count: int, seed: int, repeats: int, cache_directory: str) -> dict:
+    """ Times the voxelization, path_check and path_find on one randomized layout. """
+    rng = np.random.default_rng(seed)
+    hazards = random_hazards(rng, field_dimensions, hazard_count)
+    results = {}
+    grid_shape = tuple(int(dim/AVR_rad-0.5) for dim in field_dimensions)
+    # Same build create_path_blocker_map.py caches
+    times = [timed(voxelizer.voxelize, hazards, field_dimensions, grid_shape, AVR_rad) for _ in range(max(repeats//10, 3))]
+    results['voxelize'] = summary(times, memory=peak_memory(voxelizer.voxelize, hazards, field_dimensions, grid_shape, AVR_rad))
+
+    col_test = collision_dectector(field_dimensions, AVR_rad, hazards, cache_directory=cache_directory)
+    starts, ends = random_positions(rng, field_dimensions, repeats), random_positions(rng, field_dimensions, repeats)
+    times = [timed(col_test.path_check, tuple(start), tuple(end)) for start, end in zip(starts.tolist(), ends.tolist())]
+    results['path_check'] = summary(times, memory=peak_memory(col_test.path_check, tuple(starts[0]), tuple(ends[0])))
+
+    pairs = list(zip(free_positions(rng, col_test, repeats//4), free_positions(rng, col_test, repeats//4)))
+    for any_angle in (False, True):
+        times, expanded = [], []
+        for start, end in pairs:
+            # Every call has to plan, not hit the cache
+            col_test.plan_cache.clear()
+            times.append(timed(col_test.path_find, start, end, any_angle))
+            expanded.append(col_test.plan_stats.get('expanded', 0))
+        col_test.plan_cache.clear()
+        memory = peak_memory(col_test.path_find, pairs[0][0], pairs[0][1], any_angle)
+        results['path_find theta*' if any_angle else 'path_find a*'] = summary(times, expanded, memory)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """ Every p50/p99 time or expansion count more than tolerance times its baseline. """
+    regressions = []
+    for config, benchmarks in results.items():
+        for benchmark, stats in benchmarks.items():
+            for stat, value in stats.items():
+                old = baseline.get(config, {}).get(benchmark, {}).get(stat)
+                if stat.startswith(('p50', 'p99', 'expanded')) and old and value > old*tolerance:
+                    regressions.append(f'{config} {benchmark} {stat}: {old:.2f} -> {value:.2f}')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless benchmark of the collision avoidance and path planning')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random hazard layouts')
+    parser.add_argument('--repeats', type=int, default=200, help='Calls timed per benchmark')
+    parser.add_argument('--save', help='Write the results to this json file')
+    parser.add_argument('--baseline', help='Fail if the results are worse than this json file')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='Allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    results = {}
+    # Keep the benchmark caches away from the real ones
+    with tempfile.TemporaryDirectory() as cache_directory:
+        for i, (name, field_dimensions, hazard_count) in enumerate(CONFIGS):
+            results[name] = run_config(name, field_dimensions, hazard_count, args.seed + i, args.repeats, cache_directory)
+            print(f'{name} {field_dimensions} {hazard_count} hazards')
+            for benchmark, stats in results[name].items():
+                line = f"    {benchmark:<18} p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms  peak {stats['peak_kb']:9.1f} KB"
+                if 'expanded_p50' in stats:
+                    line += f"  expanded p50 {stats['expanded_p50']:.0f} p99 {stats['expanded_p99']:.0f}"
+                print(line)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        sys.exit(1 if regressions else 0)
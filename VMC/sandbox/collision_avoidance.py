@@ -1,143 +1,234 @@
-import math, Geometry3D, logging, sqlite3, os, pathlib
+import math, logging, os, pathlib
+from collections import OrderedDict
 import numpy as np
+from path_planner import astar, theta_star, remove_colinear
+from collision_geometry import hazards_to_arrays, segment_cylinder_distance
+from occupancy_tree import OccupancyTree
+from dstar_lite import DStarLite
+import voxelizer, distance_field, hazard_store
 
 class collision_dectector():
     """ A class to allow for the dectection and avoidence of hazards on a field. """
-    def __init__(self, field_dimensions: tuple, drone_radius: float, hazards: list = []) -> None:
-        """ Will use hazards stored in database.db, unless other hazards are given. """
+    def __init__(self, field_dimensions: tuple, drone_radius: float, hazards: list = [], fine_resolution: float = 2, plan_cache_size: int = 64, cache_directory: str = '.') -> None:
+        """ Will use hazards stored in database.db, unless other hazards are given.\n\nfine_resolution(inches) is the node size of the sparse occupancy map used for point and segment queries. plan_cache_size is how many path_find results are remembered. cache_directory is where the occupancy and distance field caches are kept, relative to this file. """
         self.field_length = field_dimensions[0]
         self.field_width = field_dimensions[1]
         self.field_height = field_dimensions[2]
         self.AVR_rad = drone_radius
-        self.hazards = []
-        self.field_rec = geo3D_rect(self.field_length, self.field_width, self.field_height)
+        self.field_dimensions = np.array(field_dimensions, dtype=float)
+        self.fine_resolution = fine_resolution
+        # Path nodes are roughly the size of the drone
+        self.grid_shape = tuple(int(dim/self.AVR_rad-0.5) for dim in field_dimensions)
+        self.node_size = tuple(dim/n for dim, n in zip(field_dimensions, self.grid_shape))
+        # Extra cost for path nodes closer than AVR_rad + clearance_margin to a hazard
+        self.clearance_margin = self.AVR_rad
+        self.use_database = not hazards
+        # Least recently used plans (and D* Lite searches, one per goal) are at the front
+        self.plan_cache = OrderedDict()
+        self.plan_cache_size = plan_cache_size
+        self.replanners = OrderedDict()
+        self.cache_directory = cache_directory
+        # Filled in by the planner on every path_find that is not cached
+        self.plan_stats = {}
         os.chdir(pathlib.Path(__file__).parent.resolve())
-        if not hazards:
-            with sqlite3.connect('database.db') as conn:
-                c = conn.cursor()
-                c.execute("""SELECT * FROM hazards""")
-                for row in c:
-                    self.hazards.append((eval(row[0]), row[1], eval(row[2])))
+        # Given hazards still get a store, for its spatial index
+        self.store = hazard_store.open_store() if self.use_database else hazard_store.HazardStore(':memory:')
+        if not self.use_database:
+            self.store.write(hazards)
+        self.set_hazards(self.store.hazards)
+
+    def read_hazards(self) -> list:
+        """ Hazards from the hazard store, only re-read from database.db when it changed. """
+        self.store.load()
+        return self.store.hazards
+
+    def set_hazards(self, hazards: list) -> None:
+        """ Rebuilds (or loads from cache) everything that depends on the hazards. """
+        field_dimensions = tuple(self.field_dimensions.tolist())
+        self.hazards = list(hazards)
+        self.hazard_key = voxelizer.hazard_hash(self.hazards, field_dimensions, self.grid_shape, self.AVR_rad)
+        # Plans for the old hazards are no good anymore
+        self.plan_cache.clear()
+        self.hazard_centers, self.hazard_radii, self.hazard_vecs = hazards_to_arrays(self.hazards)
+        # Rebuilt only when the hazards change
+        self.occupancy = voxelizer.load_or_build(self.hazards, field_dimensions, self.grid_shape, self.AVR_rad, self.cache_directory)
+        # (x, y, z) of the free nodes and their centers, for snapping positions out of blocked nodes
+        self.free_nodes = np.argwhere(~self.occupancy)[:, ::-1]
+        self.free_centers = (self.free_nodes + 0.5)*np.asarray(self.node_size)
+        # Fine map that only stores detail near hazard surfaces
+        self.tree = OccupancyTree(self.hazards, field_dimensions, self.fine_resolution, self.AVR_rad)
+        # Distance to the nearest hazard, also cached next to database.db
+        self.distance_field = distance_field.load_or_build(self.hazards, field_dimensions, self.fine_resolution, self.cache_directory)
+        node_clearance = self.distance_field.clearance(voxelizer.node_centers(field_dimensions, self.grid_shape))
+        self.clearance_penalty = np.clip((self.AVR_rad + self.clearance_margin - node_clearance)/self.clearance_margin, 0, 1)
+        for replanner in self.replanners.values():
+            # Only the nodes that changed get repaired
+            replanner.update_grid(self.occupancy, self.clearance_penalty)
+
+    def refresh_hazards(self) -> bool:
+        """ Re-reads the hazards table and rebuilds if it changed.\n\nReturns True if the hazards changed. """
+        if not self.use_database or not self.store.load():
+            return False
+        hazards = self.store.hazards
+        if voxelizer.hazard_hash(hazards, tuple(self.field_dimensions.tolist()), self.grid_shape, self.AVR_rad) == self.hazard_key:
+            return False
+        self.set_hazards(hazards)
+        return True
         
     def path_check(self, start_pos: tuple, end_pos: tuple) -> list:
-        """ Checks path for hazards and field out.\n\nReturns a list of objects path collides with. """
-        path_clear = True
+        """ Checks path for hazards and field out.\n\nReturns a list of hazards path collides with. """
         collided_geo = []
-        flight_path = Geometry3D.Cylinder(Geometry3D.Point(list(start_pos)), self.AVR_rad, Geometry3D.Vector(np.subtract(end_pos, start_pos)))
-        if not Geometry3D.intersection(Geometry3D.Point(list(end_pos)), self.field_rec):
-            path_clear = False
+        if np.any(np.less(end_pos, 0)) or np.any(np.greater(end_pos, self.field_dimensions)):
             logging.warning(f'[{start_pos} -> {end_pos}] Results in AVR moving out of bounds, comand canceled.')
-        if self.hazards:
-            for hazard in self.hazards:
-                hazard_geo = Geometry3D.Cylinder(Geometry3D.Point(list(hazard[0])), hazard[1], Geometry3D.Vector(list(hazard[2])))
-                if Geometry3D.intersection(flight_path, hazard_geo):
-                    path_clear = False
-                    collided_geo.append(hazard_geo)
-                    logging.warning(f'[{start_pos} -> {end_pos}] Results in AVR hitting hazard at {hazard[0]}')
+        # Only the hazards whose bounding box comes near the path
+        near = self.store.near_segment(start_pos, end_pos, self.AVR_rad)
+        if len(near):
+            # The drone sweeps a sphere of AVR_rad along the path
+            dist = segment_cylinder_distance(np.asarray(start_pos, dtype=float), np.asarray(end_pos, dtype=float), self.hazard_centers[near], self.hazard_radii[near], self.hazard_vecs[near], cutoff=self.AVR_rad)
+            for i in near[dist < self.AVR_rad]:
+                collided_geo.append(self.hazards[i])
+                logging.warning(f'[{start_pos} -> {end_pos}] Results in AVR hitting hazard at {self.hazards[i][0]}')
         return collided_geo
     
-    def path_find(self, start: tuple, end: tuple) -> list:
-        """  Finds list of positions to reach position with out hitting a hazard.\n\nReturns a list of tuples. Ex: [(x, y, z), (x2, y2, z2), ...]"""
-        collided_geos = self.path_check(start, end)
-        nodes = []
-        with sqlite3.connect('database.db') as conn:
-            c = conn.cursor()
-            c.execute("""SELECT * FROM path_nodes""")
-            for row in c:
-                nodes.append((eval(row[0]), row[1]))
-        node_size = (self.field_length/int(self.field_length/self.AVR_rad-0.5), self.field_width/int(self.field_width/self.AVR_rad-0.5), self.field_height/int(self.field_height/self.AVR_rad-0.5))
-        # Define the surrounding nodes in 3D space
-        surrounding_nodes = [
-            (-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1)
-        ]
-
-        def heuristic(node):
-            return ((node[0] - end[0])**2+(node[1] - end[1])**2+(node[2] - end[2])**2)**0.5 # Direct dist
-            return abs(node[0] - end[0]) + abs(node[1] - end[1]) + abs(node[2] - end[2])  # Grid dist
-
-        def get_neighbors(node):
-            neighbors = []
-            for dx, dy, dz in surrounding_nodes:
-                x, y, z = node[0] + dx, node[1] + dy, node[2] + dz
-                if (
-                    0 <= x < len(nodes[0][0]) and
-                    0 <= y < len(nodes[0]) and
-                    0 <= z < len(nodes) and
-                    nodes[z][y][x] != 1
-                ):
-                    neighbors.append((x, y, z))
-            return neighbors
-
-        open_set = [start]
-        came_from = {}
-        g_score = {(x, y, z): float('inf') for z, layer in enumerate(nodes) for y, row in enumerate(layer) for x, _ in enumerate(row)}
-        g_score[start] = 0
-        f_score = {(x, y, z): float('inf') for z, layer in enumerate(nodes) for y, row in enumerate(layer) for x, _ in enumerate(row)}
-        f_score[start] = heuristic(start)
-
-        while open_set:
-            current = min(open_set, key=lambda node: f_score[node])
-
-            if current == end:
-                path = [current]
-                while current in came_from:
-                    current = came_from[current]
-                    path.append(current)
-                path.reverse()
-                # Path cleanup
-                # Get rid of extraneous path nodes
-                opti_path = [path[0]]
-                prev_node = None
-                print(path)
-                for i in range(len(path)):
-                    if i+1 > len(path)-1:
-                        break
-                    for j in range(len(path[i+1])):
-                        if abs(path[i+1][j] - path[i][j]) == 1:
-                            k=i
-                            while abs(path[k+1][j] - path[k][j]) == 1:
-                                k+=1
-                                if k+1 > len(path)-1:
-                                    break
-                            print(path[k])
-                            opti_path.append(path[k])
-                            break
-                opti_path = [i for n, i in enumerate(opti_path) if i not in opti_path[:n]]
-                # Shorten path by turning repeated turns into diagonals
-                smooth_path = [opti_path[0]]
-                for i in range(len(path)):
-                    j = i+1
-                    while j in range(len(path)):
-                        print(path[i], path[j])
-                        collided = False 
-                        for geo in collided_geos:
-                            if Geometry3D.intersection(geo, Geometry3D.Cylinder(Geometry3D.Point(list(path[i])), self.AVR_rad, Geometry3D.Vector(np.subtract(path[j], path[i])))):
-                                smooth_path.append(path[j-1])
-                                smooth_path.append(path[j])
-                                break
-                        if collided:
-                            i = j
-                            break
-                        j+=1
-                # Adjust path to center of nodes
-                for node in smooth_path:
-                    node = tuple(np.add(node, np.divide(node_size, 2)))
-                return smooth_path
-
-            open_set.remove(current)
-            for neighbor in get_neighbors(current):
-                tentative_g_score = g_score[current] + 1
-                if tentative_g_score < g_score[neighbor]:
-                    came_from[neighbor] = current
-                    g_score[neighbor] = tentative_g_score
-                    f_score[neighbor] = g_score[neighbor] + heuristic(neighbor)
-                    if neighbor not in open_set:
-                        open_set.append(neighbor)
-
-        print("No valid path found")
-        return None
-        
-                        
+    def validate_route(self, waypoints: list, margin: float = 0) -> tuple:
+        """ Checks every leg of a route for hazards and field out in one pass.\n\nReturns (clearances, first_violation). clearances[i] is the space between the drone and the nearest hazard on leg i, negative if they hit. Clearances above margin are only lower bounds. first_violation is None or (leg index, hazard hit or None if out of bounds). """
+        points = np.asarray(waypoints, dtype=float).reshape(-1, 3)
+        starts, ends = points[:-1], points[1:]
+        clearances = np.full(len(starts), np.inf)
+        hits = np.zeros(len(starts), dtype=bool)
+        near = self.store.query_box(points.min(axis=0) - self.AVR_rad - margin, points.max(axis=0) + self.AVR_rad + margin) if len(starts) else []
+        if len(near):
+            dist = segment_cylinder_distance(starts[:, None], ends[:, None], self.hazard_centers[near], self.hazard_radii[near], self.hazard_vecs[near], cutoff=self.AVR_rad + margin) - self.AVR_rad
+            nearest = near[dist.argmin(axis=1)]
+            clearances = dist.min(axis=1)
+            hits = clearances < 0
+        # The field is convex, so a leg stays inside when its end points do
+        out = np.any((points < 0) | (points > self.field_dimensions), axis=1)
+        out = out[:-1] | out[1:]
+        first_violation = None
+        bad = np.flatnonzero(hits | out)
+        if len(bad):
+            leg = int(bad[0])
+            first_violation = (leg, None if out[leg] else self.hazards[nearest[leg]])
+            logging.warning(f'[{tuple(starts[leg].tolist())} -> {tuple(ends[leg].tolist())}] Leg {leg} of route ' + ('moves AVR out of bounds' if out[leg] else f'results in AVR hitting hazard at {self.hazards[nearest[leg]][0]}'))
+        return clearances, first_violation
+
+    def path_find(self, start: tuple, end: tuple, any_angle: bool = False, clearance_weight: float = 1) -> list:
+        """  Finds list of positions to reach position with out hitting a hazard.\n\nany_angle uses Theta*, which shortcuts the path while searching so only the turns are returned. clearance_weight scales the extra cost of passing close to hazards, 0 turns it off.\n\nReturns a list of tuples. Ex: [(x, y, z), (x2, y2, z2), ...]"""
+        start_node = self.free_node(start)
+        end_node = self.free_node(end)
+        if start_node is None or end_node is None:
+            logging.warning(f'[{start} -> {end}] No free node to plan from')
+            return None
+        key = (start_node, end_node, any_angle, clearance_weight, self.hazard_key)
+        if key in self.plan_cache:
+            self.plan_cache.move_to_end(key)
+            turns = self.plan_cache[key]
+        else:
+            penalty = self.clearance_penalty*clearance_weight if clearance_weight else None
+            if any_angle:
+                # Shortcuts are checked against the hazards themselves, not just the coarse nodes
+                path = theta_star(self.occupancy, start_node, end_node, self.node_size, penalty, self.plan_stats, lambda a, b: self.leg_clear(self.node_to_pos(a), self.node_to_pos(b)))
+            else:
+                path = astar(self.occupancy, start_node, end_node, penalty, self.plan_stats)
+            # Path cleanup
+            # Only keep the nodes where the path changes direction, adjusted to the center of the nodes
+            turns = None if path is None else [self.node_to_pos(node) for node in remove_colinear(path)[1:-1]]
+            self.plan_cache[key] = turns
+            if len(self.plan_cache) > self.plan_cache_size:
+                self.plan_cache.popitem(last=False)
+        if turns is None:
+            logging.warning(f'[{start} -> {end}] No valid path found')
+            return None
+        return self.snapped_path(start, end, start_node, end_node, turns)
+
+    def is_blocked(self, pos: tuple) -> bool:
+        """ Checks if the drone can not be at pos(inches) without hitting a hazard or leaving the field. """
+        return bool(self.tree.occupied(pos))
+
+    def leg_clear(self, start_pos: tuple, end_pos: tuple) -> bool:
+        """ Checks if the drone can fly straight from start_pos to end_pos(inches) without hitting a hazard, exactly like validate_route does. """
+        near = self.store.near_segment(start_pos, end_pos, self.AVR_rad)
+        if not len(near):
+            return True
+        dist = segment_cylinder_distance(np.asarray(start_pos, dtype=float), np.asarray(end_pos, dtype=float), self.hazard_centers[near], self.hazard_radii[near], self.hazard_vecs[near], cutoff=self.AVR_rad)
+        return bool(np.all(dist >= self.AVR_rad))
+
+    def segment_blocked(self, start_pos: tuple, end_pos: tuple) -> bool:
+        """ Checks if a straight path crosses any blocked part of the fine map. """
+        return self.tree.segment_occupied(start_pos, end_pos)
+
+    def replan(self, start: tuple, end: tuple) -> list:
+        """ Like path_find, but keeps the search between calls with D* Lite.\n\nA moved start or changed hazards (see refresh_hazards) only cost a partial repair. Searches for recent goals are kept, so going back to one is nearly free.\n\nReturns a list of tuples. Ex: [(x, y, z), (x2, y2, z2), ...]"""
+        if not self.is_blocked(start) and not self.segment_blocked(start, end):
+            # Straight there, like after the hazard that was in the way moved
+            return [tuple(start), tuple(end)]
+        start_node = self.pos_to_node(start)
+        end_node = self.free_node(end)
+        if end_node is None:
+            logging.warning(f'[{start} -> {end}] No free node to plan to')
+            return None
+        if self.occupancy[start_node[2], start_node[1], start_node[0]]:
+            # D* Lite can not start inside a blocked node, plan out of it from scratch
+            return self.path_find(start, end)
+        if end_node in self.replanners:
+            self.replanners.move_to_end(end_node)
+            replanner = self.replanners[end_node]
+            replanner.move_start(start_node)
+        else:
+            replanner = DStarLite(self.occupancy, start_node, end_node, self.node_size, self.clearance_penalty)
+            self.replanners[end_node] = replanner
+            # Searches are much bigger than plans, keep only a few
+            if len(self.replanners) > max(self.plan_cache_size//8, 1):
+                self.replanners.popitem(last=False)
+        path = replanner.plan()
+        if path is None:
+            logging.warning(f'[{start} -> {end}] No valid path found')
+            return None
+        path = remove_colinear(path)
+        return self.snapped_path(start, end, start_node, end_node, [self.node_to_pos(node) for node in path[1:-1]])
+
+    def free_node(self, pos: tuple) -> tuple:
+        """ Node containing pos(inches), or the nearest free node when that one is blocked.
+
+The coarse nodes are blocked when their center is near a hazard, so a position with room for the drone (or one on top of a building) can still be in a blocked node. Returns None if every node is blocked. """
+        node = self.pos_to_node(pos)
+        if not self.occupancy[node[2], node[1], node[0]]:
+            return node
+        if not len(self.free_nodes):
+            return None
+        nearest = np.linalg.norm(self.free_centers - np.asarray(pos, dtype=float), axis=1).argmin()
+        return tuple(int(i) for i in self.free_nodes[nearest])
+
+    def snapped_path(self, start: tuple, end: tuple, start_node: tuple, end_node: tuple, turns: list) -> list:
+        """ Path from start through turns to end, going through the centers of start_node and end_node when start or end were snapped to them.\n\nThe planner only checked the legs from those centers, so they are also kept when the leg straight from start or to end would hit a hazard. """
+        start_center, end_center = self.node_to_pos(start_node), self.node_to_pos(end_node)
+        first = turns[0] if turns else end_center
+        last = turns[-1] if turns else start_center
+        path = [tuple(start)]
+        if start_node != self.pos_to_node(start) or not self.leg_clear(start, first):
+            path.append(start_center)
+        path += turns
+        if end_node != self.pos_to_node(end) or not self.leg_clear(last, end):
+            path.append(end_center)
+        return path + [tuple(end)]
+
+    def clearance(self, pos: tuple) -> float:
+        """ Distance(inches) from the center of the drone at pos to the nearest hazard. Less than AVR_rad means a hit. """
+        return float(self.distance_field.clearance(pos))
+
+    def clearance_gradient(self, pos: tuple) -> tuple:
+        """ Direction of increasing clearance at pos, per inch. """
+        return tuple(self.distance_field.gradient(pos).tolist())
+
+    def pos_to_node(self, pos: tuple) -> tuple:
+        """ Converts a field position (inches) to the (x, y, z) index of the node containing it. """
+        return tuple(int(min(max(pos[i] // self.node_size[i], 0), self.grid_shape[i] - 1)) for i in range(3))
+
+    def node_to_pos(self, node: tuple) -> tuple:
+        """ Converts a node index to the field position (inches) of its center. """
+        return tuple(float((node[i] + 0.5) * self.node_size[i]) for i in range(3))
+
 def data_for_cylinder_along_z(center_x,center_y,radius,height_z, start_z = 0):
     z = np.linspace(start_z, height_z, 50)
     theta = np.linspace(0, 2*np.pi, 50)
@@ -145,23 +236,3 @@ def data_for_cylinder_along_z(center_x,center_y,radius,height_z, start_z = 0):
     x_grid = radius*np.cos(theta_grid) + center_x
     y_grid = radius*np.sin(theta_grid) + center_y
     return x_grid,y_grid,z_grid
-def geo3D_rect(length: int, width: int, height: int, pos: tuple = (0, 0, 0)) -> Geometry3D.ConvexPolyhedron:
-    """ Function that creates a 3d rectangle based on the length, width and height parameters\n\nReturns a Geometry3D.ConvexPolyhedron object."""
-    a = Geometry3D.Point(list(pos))
-    b = Geometry3D.Point(list(np.add(pos, (length, 0, 0))))
-    c = Geometry3D.Point(list(np.add(pos, (0, width, 0))))
-    d = Geometry3D.Point(list(np.add(pos, (length, width, 0))))
-    e = Geometry3D.Point(list(np.add(pos, (0, 0, height))))
-    f = Geometry3D.Point(list(np.add(pos, (length, 0, height))))
-    g = Geometry3D.Point(list(np.add(pos, (0, width, height))))
-    h = Geometry3D.Point(list(np.add(pos, (length, width, height))))
-    field_face0 = Geometry3D.ConvexPolygon((a, b, c, d))
-    field_face1 = Geometry3D.ConvexPolygon((a, b, f, e))
-    field_face2 = Geometry3D.ConvexPolygon((a, c, g, e))
-    field_face3 = Geometry3D.ConvexPolygon((c, d, h, g))
-    field_face4 = Geometry3D.ConvexPolygon((b, d, h, f))
-    field_face5 = Geometry3D.ConvexPolygon((e, f, h, g))
-    return Geometry3D.ConvexPolyhedron((field_face0,field_face1,field_face2,field_face3,field_face4,field_face5))
-
-def geoPoint_to_tuple(self, point: Geometry3D.Point):
-    return point.x, point.y, point.z
\ No newline at end of file
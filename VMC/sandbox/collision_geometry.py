@@ -0,0 +1,96 @@
+import numpy as np
+
+# Samples per refinement pass of segment_cylinder_distance
+SAMPLES = 17
+
+def hazards_to_arrays(hazards: list) -> tuple:
+    """ Splits (center, radius, height_vec) hazard rows into NumPy arrays.\n\nReturns (centers (H, 3), radii (H,), height_vecs (H, 3)). """
+    centers = np.array([h[0] for h in hazards], dtype=float).reshape(-1, 3)
+    radii = np.array([h[1] for h in hazards], dtype=float)
+    height_vecs = np.array([h[2] for h in hazards], dtype=float).reshape(-1, 3)
+    return centers, radii, height_vecs
+
+def point_cylinder_distance(points: np.ndarray, centers: np.ndarray, radii, height_vecs: np.ndarray) -> np.ndarray:
+    """ Distance from points to the surface of solid cylinders, 0 inside.\n\nThe cylinder axis runs from center to center + height_vec. All arguments broadcast against each other, points and centers on their last axis. """
+    lengths = np.linalg.norm(height_vecs, axis=-1)
+    axes = height_vecs/lengths[..., None]
+    rel = points - centers
+    t = np.einsum('...i,...i->...', rel, axes)
+    radial = np.linalg.norm(rel - t[..., None]*axes, axis=-1)
+    outside_r = np.maximum(radial - radii, 0)
+    outside_h = np.maximum(np.maximum(-t, t - lengths), 0)
+    return np.hypot(outside_r, outside_h)
+
+def segment_segment_distance(p0: np.ndarray, p1: np.ndarray, q0: np.ndarray, q1: np.ndarray) -> np.ndarray:
+    """ Closed form closest distance between segments p0-p1 and q0-q1. Arguments broadcast on their leading axes. """
+    return closest_segment_points(p0, p1, q0, q1)[0]
+
+def closest_segment_points(p0: np.ndarray, p1: np.ndarray, q0: np.ndarray, q1: np.ndarray) -> tuple:
+    """ Closed form closest points between segments p0-p1 and q0-q1.\n\nReturns (distance, s, t) where the closest points are p0 + s*(p1 - p0) and q0 + t*(q1 - q0). """
+    d1 = p1 - p0
+    d2 = q1 - q0
+    r = p0 - q0
+    a = np.einsum('...i,...i->...', d1, d1)
+    e = np.einsum('...i,...i->...', d2, d2)
+    f = np.einsum('...i,...i->...', d2, r)
+    c = np.einsum('...i,...i->...', d1, r)
+    b = np.einsum('...i,...i->...', d1, d2)
+    a, e, f, c, b = np.broadcast_arrays(a, e, f, c, b)
+    denom = a*e - b*b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Parallel or degenerate segments fall back to s = 0
+        s = np.where(denom > 1e-12, np.clip((b*f - c*e)/denom, 0, 1), 0.0)
+        s_c = np.where(a > 1e-12, np.clip(-c/a, 0, 1), 0.0)
+        t = np.where(e > 1e-12, (b*s + f)/e, 0.0)
+        s = np.where(e > 1e-12, s, s_c)
+        s = np.where(t < 0, s_c, s)
+        s = np.where(t > 1, np.where(a > 1e-12, np.clip((b - c)/a, 0, 1), 0.0), s)
+    t = np.clip(t, 0, 1)
+    closest_p = p0 + s[..., None]*d1
+    closest_q = q0 + t[..., None]*d2
+    return np.linalg.norm(closest_p - closest_q, axis=-1), s, t
+
+def segment_cylinder_distance(start: np.ndarray, end: np.ndarray, centers: np.ndarray, radii: np.ndarray, height_vecs: np.ndarray, cutoff: float = np.inf, iterations: int = 5) -> np.ndarray:
+    """ Closest distance between path segments and solid cylinders, 0 when they touch.\n\nstart/end: (..., 3) broadcasting against the hazard arrays. Distances above cutoff are only guaranteed to be above cutoff. """
+    start, end, centers, height_vecs = np.broadcast_arrays(start, end, centers, height_vecs)
+    radii = np.broadcast_to(radii, start.shape[:-1])
+    # The capsule around the cylinder axis contains the cylinder, so it gives a cheap lower bound.
+    # It is exact unless the closest point on the axis is an end of it, then the caps matter.
+    axis_dist, _, t = closest_segment_points(start, end, centers, centers + height_vecs)
+    dist = np.maximum(axis_dist - radii, 0)
+    near = (dist < cutoff) & ((t <= 0) | (t >= 1))
+    if not near.any():
+        return dist
+    # Distance to a convex solid is convex along a segment. Sample it, then keep resampling the
+    # bracket around the best sample to close in on the exact minimum.
+    base = start[near] - centers[near]
+    d = end[near] - start[near]
+    r = radii[near][:, None]
+    lengths = np.linalg.norm(height_vecs[near], axis=-1)
+    axes = height_vecs[near]/lengths[:, None]
+    lengths = lengths[:, None]
+    # Everything below is quadratic in s, so it is precomputed per hazard
+    tb = np.einsum('ij,ij->i', base, axes)[:, None]
+    td = np.einsum('ij,ij->i', d, axes)[:, None]
+    bb = np.einsum('ij,ij->i', base, base)[:, None]
+    bd = np.einsum('ij,ij->i', base, d)[:, None]
+    dd = np.einsum('ij,ij->i', d, d)[:, None]
+    def f(s):
+        t = tb + s*td
+        radial = np.sqrt(np.maximum(bb + 2*bd*s + dd*s*s - t*t, 0))
+        return np.hypot(np.maximum(radial - r, 0), np.maximum(np.maximum(-t, t - lengths), 0))
+    rows = np.arange(len(base))
+    lo = np.zeros((len(base), 1))
+    width = np.ones((len(base), 1))
+    grid = np.linspace(0, 1, SAMPLES)
+    for _ in range(iterations):
+        samples = lo + width*grid
+        f_samples = f(samples)
+        best = f_samples.argmin(axis=1)
+        step = width/(SAMPLES - 1)
+        lo = np.clip(samples[rows, best][:, None] - step, 0, 1)
+        width = np.minimum(2*step, 1 - lo)
+    best_dist = f_samples[rows, best]
+    dist = dist.copy()
+    dist[near] = best_dist
+    return dist
@@ -0,0 +1,62 @@
+import numpy as np
+from scipy import ndimage
+import voxelizer
+
+CACHE_PREFIX = 'clearance_'
+
+def build_distance_field(hazards: list, field_dimensions: tuple, grid_shape: tuple) -> np.ndarray:
+    """ Euclidean distance transform of the hazards, indexed [z][y][x].\n\nEach node holds the distance(inches) from its center to the nearest hazard, to within about half a node. """
+    node_size = tuple(dim/n for dim, n in zip(field_dimensions, grid_shape))
+    # Nodes whose center is about inside a hazard
+    blocked = voxelizer.voxelize(hazards, field_dimensions, grid_shape, min(node_size)/2)
+    if not blocked.any():
+        return np.full(blocked.shape, np.inf, dtype=np.float32)
+    field = ndimage.distance_transform_edt(~blocked, sampling=node_size[::-1])
+    # Distances are to blocked node centers, the hazard surface is about half a node closer
+    return np.maximum(field - min(node_size)/2, 0).astype(np.float32)
+
+def load_or_build(hazards: list, field_dimensions: tuple, resolution: float, directory: str = '.') -> 'DistanceField':
+    """ Loads the cached distance field for these hazards, building and saving it first if needed. """
+    grid_shape = tuple(int(np.ceil(dim/resolution)) for dim in field_dimensions)
+    key = voxelizer.hazard_hash(hazards, field_dimensions, grid_shape, 0)
+    field = voxelizer.cached(CACHE_PREFIX, key, lambda: build_distance_field(hazards, field_dimensions, grid_shape), directory)
+    return DistanceField(field, field_dimensions)
+
+class DistanceField():
+    """ Trilinear lookups into a precomputed distance field. """
+    def __init__(self, field: np.ndarray, field_dimensions: tuple) -> None:
+        self.field = field
+        # (x, y, z) counts and node size
+        self.grid_shape = np.array(field.shape[::-1])
+        self.node_size = np.array(field_dimensions, dtype=float)/self.grid_shape
+
+    def clearance(self, points: np.ndarray) -> np.ndarray:
+        """ Distance(inches) from each point to the nearest hazard. Points outside of the field are clamped to its edge. """
+        points = np.asarray(points, dtype=float)
+        coords = np.clip(points/self.node_size - 0.5, 0, self.grid_shape - 1)
+        lower = np.minimum(np.floor(coords).astype(np.int64), np.maximum(self.grid_shape - 2, 0))
+        frac = coords - lower
+        upper = np.minimum(lower + 1, self.grid_shape - 1)
+        x = (lower[..., 0], upper[..., 0])
+        y = (lower[..., 1], upper[..., 1])
+        z = (lower[..., 2], upper[..., 2])
+        fx, fy, fz = frac[..., 0], frac[..., 1], frac[..., 2]
+        result = 0
+        for i in (0, 1):
+            wz = fz if i else 1 - fz
+            for j in (0, 1):
+                wy = fy if j else 1 - fy
+                for k in (0, 1):
+                    wx = fx if k else 1 - fx
+                    result = result + wz*wy*wx*self.field[z[i], y[j], x[k]]
+        return result
+
+    def gradient(self, points: np.ndarray) -> np.ndarray:
+        """ Central difference gradient of the clearance at each point, points away from the nearest hazard. """
+        points = np.asarray(points, dtype=float)
+        grad = np.zeros(points.shape)
+        for i in range(3):
+            step = np.zeros(3)
+            step[i] = self.node_size[i]/2
+            grad[..., i] = (self.clearance(points + step) - self.clearance(points - step))/(2*step[i])
+        return grad
@@ -0,0 +1,146 @@
+import heapq
+import numpy as np
+from path_planner import ALL_NEIGHBORS
+
+INF = float('inf')
+
+class DStarLite():
+    """ Incremental D* Lite planner over a boolean occupancy grid indexed [z][y][x].\n\nThe search runs from the goal back to the start and is kept between calls, so moving the start or changing a few nodes only repairs the part of the search they affect. """
+    def __init__(self, occupancy: np.ndarray, start: tuple, goal: tuple, node_size: tuple = (1, 1, 1), penalty: np.ndarray = None) -> None:
+        """ start and goal are (x, y, z) node indices. penalty is an optional extra cost per unit length near each node. """
+        self.nz, self.ny, self.nx = occupancy.shape
+        self.node_size = node_size
+        size = occupancy.size
+        # Plain lists, single element access is much faster than on NumPy arrays
+        self.blocked = np.asarray(occupancy, dtype=bool).ravel().tolist()
+        self.extra = [0.0]*size if penalty is None else np.asarray(penalty, dtype=float).ravel().tolist()
+        self.g = [INF]*size
+        self.rhs = [INF]*size
+        self.neighbor_cache = [None]*size
+        self.goal = self.flat(goal)
+        self.start = self.flat(start)
+        self.last_start = self.start
+        self.km = 0.0
+        self.open_set = []
+        # Current key of every node in open_set, entries that do not match it are stale
+        self.open_key = {}
+        self.expanded = 0
+        self.rhs[self.goal] = 0
+        self.push(self.goal)
+
+    def flat(self, node: tuple) -> int:
+        return (node[2]*self.ny + node[1])*self.nx + node[0]
+
+    def unflat(self, i: int) -> tuple:
+        z, rem = divmod(int(i), self.nx*self.ny)
+        y, x = divmod(rem, self.nx)
+        return (x, y, z)
+
+    def neighbors(self, i: int) -> list:
+        """ (neighbor, distance, corners) of every node around i. corners are the nodes a diagonal move to the neighbor cuts past. """
+        if self.neighbor_cache[i] is None:
+            x, y, z = self.unflat(i)
+            sx, sy, sz = self.node_size
+            result = []
+            for dx, dy, dz in ALL_NEIGHBORS:
+                nx_, ny_, nz_ = x + dx, y + dy, z + dz
+                if 0 <= nx_ < self.nx and 0 <= ny_ < self.ny and 0 <= nz_ < self.nz:
+                    # Every node between i and the neighbor, moving along some of the axes of the step but not all
+                    corners = tuple(((z + cz)*self.ny + y + cy)*self.nx + x + cx for cx in {0, dx} for cy in {0, dy} for cz in {0, dz} if (cx, cy, cz) not in ((0, 0, 0), (dx, dy, dz)))
+                    result.append(((nz_*self.ny + ny_)*self.nx + nx_, ((dx*sx)**2 + (dy*sy)**2 + (dz*sz)**2)**0.5, corners))
+            self.neighbor_cache[i] = result
+        return self.neighbor_cache[i]
+
+    def length(self, a: int, b: int) -> float:
+        ax, ay, az = self.unflat(a)
+        bx, by, bz = self.unflat(b)
+        sx, sy, sz = self.node_size
+        return (((ax - bx)*sx)**2 + ((ay - by)*sy)**2 + ((az - bz)*sz)**2)**0.5
+
+    def cost(self, a: int, b: int, length: float, corners: tuple = ()) -> float:
+        blocked = self.blocked
+        # Diagonal moves can not cut the corner of a blocked node
+        if blocked[a] or blocked[b] or any(blocked[c] for c in corners):
+            return INF
+        return length*(1 + (self.extra[a] + self.extra[b])/2)
+
+    def key(self, i: int) -> tuple:
+        m = min(self.g[i], self.rhs[i])
+        return (m + self.length(self.start, i) + self.km, m)
+
+    def push(self, i: int) -> None:
+        k = self.key(i)
+        self.open_key[i] = k
+        heapq.heappush(self.open_set, (k, i))
+
+    def top_key(self) -> tuple:
+        while self.open_set:
+            k, i = self.open_set[0]
+            if self.open_key.get(i) == k:
+                return k
+            heapq.heappop(self.open_set)
+        return (INF, INF)
+
+    def update_vertex(self, i: int) -> None:
+        if i != self.goal:
+            g = self.g
+            self.rhs[i] = min([self.cost(i, n, d, c) + g[n] for n, d, c in self.neighbors(i)], default=INF)
+        self.open_key.pop(i, None)
+        if self.g[i] != self.rhs[i]:
+            self.push(i)
+
+    def compute_shortest_path(self) -> None:
+        while self.top_key() < self.key(self.start) or self.rhs[self.start] != self.g[self.start]:
+            k_old, u = heapq.heappop(self.open_set)
+            del self.open_key[u]
+            self.expanded += 1
+            k_new = self.key(u)
+            if k_old < k_new:
+                self.push(u)
+            elif self.g[u] > self.rhs[u]:
+                self.g[u] = self.rhs[u]
+                for n, _, _ in self.neighbors(u):
+                    self.update_vertex(n)
+            else:
+                self.g[u] = INF
+                self.update_vertex(u)
+                for n, _, _ in self.neighbors(u):
+                    self.update_vertex(n)
+
+    def move_start(self, start: tuple) -> None:
+        """ Moves the start node. The old search stays valid, keys are corrected with km. """
+        self.start = self.flat(start)
+        self.km += self.length(self.last_start, self.start)
+        self.last_start = self.start
+
+    def update_grid(self, occupancy: np.ndarray, penalty: np.ndarray = None) -> None:
+        """ Applies a new occupancy grid (and penalty), repairing only around the nodes that changed. """
+        blocked = np.asarray(occupancy, dtype=bool).ravel()
+        extra = np.asarray(self.extra if penalty is None else penalty, dtype=float).ravel()
+        changed = np.flatnonzero((blocked != self.blocked) | (extra != self.extra))
+        if not len(changed):
+            return
+        self.km += self.length(self.last_start, self.start)
+        self.last_start = self.start
+        self.blocked = blocked.tolist()
+        self.extra = extra.tolist()
+        touched = set()
+        for i in changed.tolist():
+            touched.add(i)
+            touched.update(n for n, _, _ in self.neighbors(i))
+        for i in touched:
+            self.update_vertex(i)
+
+    def plan(self) -> list:
+        """ Repairs the search and follows it from the start to the goal.\n\nReturns a list of node tuples, or None if the goal can not be reached. """
+        self.compute_shortest_path()
+        if self.g[self.start] == INF:
+            return None
+        path = [self.start]
+        current = self.start
+        while current != self.goal:
+            current = min(self.neighbors(current), key=lambda ndc: self.cost(current, *ndc) + self.g[ndc[0]])[0]
+            if self.g[current] == INF or len(path) > len(self.g):
+                return None
+            path.append(current)
+        return [self.unflat(i) for i in path]
@@ -0,0 +1,32 @@
+# Competition field layout, in inches. Positions are (x, y, z) from the field corner.
+FIELD_DIMENSIONS = (472, 170, 200)
+AVR_RAD = 17.3622
+
+# (180, 50, 0) on the ground pad, only use this on homefield firehouse start
+START_POS = (231, 85, 52)
+
+# Drop points above the roofs, the hazards in database.db are the towers under them
+BUILDING_LOC = {
+    'Building 0': (404, 120, 168),
+    'Building 1': (404, 45, 168),
+    'Building 2': (356, 117, 112),
+    'Building 3': (356, 53, 112),
+    'Building 4': (310, 125, 121),
+    'Building 5': (310, 50, 121),
+}
+
+# The building pad is on the fire rescue building, where START_POS is
+LANDING_PADS = {'ground': (180, 50, 12), 'building': (231, 85, 52)}
+
+def building_locations(height_is_75_scale: bool = True) -> dict:
+    """ Building positions, with heights scaled to 75% when the field is built that way. """
+    if not height_is_75_scale:
+        return dict(BUILDING_LOC)
+    return {name: (pos[0], pos[1], pos[2]*0.75) for name, pos in BUILDING_LOC.items()}
+
+def named_locations(height_is_75_scale: bool = True) -> dict:
+    """ Every named point the drone flies between. """
+    locations = {'Start': START_POS}
+    locations.update({f'Pad {name}': pos for name, pos in LANDING_PADS.items()})
+    locations.update(building_locations(height_is_75_scale))
+    return locations
@@ -0,0 +1,26 @@
+import math
+import numpy as np
+from collision_avoidance import collision_dectector
+from thermal_geolocation import ThermalGeolocator, rotation
+
+test = collision_dectector((472, 170, 200), 17.3622)
+geolocator = ThermalGeolocator(test)
+
+# Same as t3d.euler.euler2mat(psi, theta, phi, axes='rxyz')
+psi, theta, phi = 0.1, 0.2, 0.3
+cx, sx, cy, sy, cz, sz = math.cos(psi), math.sin(psi), math.cos(theta), math.sin(theta), math.cos(phi), math.sin(phi)
+expected = np.array([[cy*cz, -cy*sz, sy],
+                     [cx*sz + sx*sy*cz, cx*cz - sx*sy*sz, -sx*cy],
+                     [sx*sz - cx*sy*cz, sx*cz + cx*sy*sz, cx*cy]])
+assert np.allclose(geolocator.body_to_ned((psi, theta, phi)), expected)
+assert np.allclose(rotation(1, theta) @ (1, 0, 0), (math.cos(theta), 0, -math.sin(theta)))
+
+# Nose pitched 10 degrees up and the turret tilted 40 degrees down, looking 30 degrees below north
+tilt_pulse = geolocator.center_pulse + math.radians(-40)/geolocator.radians_per_us
+center = (geolocator.image_center, geolocator.image_center)
+point = geolocator.locate(center, (geolocator.center_pulse, tilt_pulse), (150, 150, 60), (0, math.radians(10), 0))
+print(point)
+assert np.allclose(point, (150 + 60/math.tan(math.radians(30)), 150, 0), atol=0.5)
+
+# Tilting up sees nothing on the floor
+assert geolocator.ray(center, (geolocator.center_pulse, geolocator.center_pulse + 100), (0, 0, 0))[2] > 0
@@ -0,0 +1,119 @@
+import ast, logging, os, sqlite3, threading
+import numpy as np
+from collision_geometry import hazards_to_arrays
+
+# Stored as PRAGMA user_version. 0 is the old string hazards table.
+SCHEMA_VERSION = 1
+
+class HazardStore():
+    """ Hazards kept in database.db with numeric columns, plus an R-tree of their bounding boxes.\n\nRows are read once and kept in memory, they are only re-read when the file changes. The R-tree is rebuilt in memory on every read, so opening and reading never change db_file. """
+    def __init__(self, db_file: str = 'database.db') -> None:
+        """ db_file ':memory:' gives a store that only lives in this process. """
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.index = sqlite3.connect(':memory:', check_same_thread=False)
+        self.index.execute("""CREATE VIRTUAL TABLE hazard_index USING rtree(id, min_x, max_x, min_y, max_y, min_z, max_z)""")
+        # (mtime, size) of db_file when it was last read
+        self.file_version = None
+        self.hazards = []
+        self.load()
+
+    def version(self) -> int:
+        return self.conn.execute("""PRAGMA user_version""").fetchone()[0]
+
+    def migrate(self) -> None:
+        """ Creates the hazard_store table, moving hazards over from the old string table if there is one.\n\nOnly run explicitly, by SQL_Setup.py or write. The old table is dropped in the same transaction, so there is only ever one copy of the hazards. """
+        with self.lock, self.conn:
+            c = self.conn.cursor()
+            if self.version() >= SCHEMA_VERSION:
+                return
+            c.execute("""CREATE TABLE IF NOT EXISTS hazard_store (
+                              id INTEGER PRIMARY KEY,
+                              x REAL NOT NULL,
+                              y REAL NOT NULL,
+                              z REAL NOT NULL,
+                              radius REAL NOT NULL,
+                              hx REAL NOT NULL,
+                              hy REAL NOT NULL,
+                              hz REAL NOT NULL
+                              )""")
+            old = self.read_old(c)
+            if old:
+                self.insert(c, old)
+                logging.warning(f'Moved {len(old)} hazards to the hazard_store table')
+            c.execute("""DROP TABLE IF EXISTS hazards""")
+            c.execute(f"""PRAGMA user_version = {SCHEMA_VERSION}""")
+
+    def read_old(self, c: sqlite3.Cursor) -> list:
+        """ Hazards in the old string hazards table, empty if there is none. """
+        if not c.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name='hazards'""").fetchone():
+            return []
+        # Old rows are tuples stored as text, literal_eval only accepts literals
+        return [(ast.literal_eval(position), radius, ast.literal_eval(height_vec)) for position, radius, height_vec in c.execute("""SELECT position, radius, height_vec FROM hazards""")]
+
+    def insert(self, c: sqlite3.Cursor, hazards: list) -> None:
+        c.executemany("""INSERT INTO hazard_store (x, y, z, radius, hx, hy, hz) VALUES (?, ?, ?, ?, ?, ?, ?)""", [(*map(float, center), float(radius), *map(float, height_vec)) for center, radius, height_vec in hazards])
+
+    def write(self, hazards: list) -> None:
+        """ Replaces every stored hazard. hazards: [((x, y, z), radius, (hx, hy, hz)), ...] """
+        self.migrate()
+        with self.lock, self.conn:
+            c = self.conn.cursor()
+            c.execute("""DELETE FROM hazard_store""")
+            self.insert(c, hazards)
+        self.load(force=True)
+
+    def load(self, force: bool = False) -> bool:
+        """ Re-reads the hazards if db_file changed since the last read. A database that was not migrated yet is read from the old table.\n\nReturns True if they were re-read. """
+        file_version = None
+        if self.db_file != ':memory:':
+            stat = os.stat(self.db_file)
+            file_version = (stat.st_mtime_ns, stat.st_size)
+            if file_version == self.file_version and not force:
+                return False
+        with self.lock:
+            if self.version() >= SCHEMA_VERSION:
+                rows = self.conn.execute("""SELECT x, y, z, radius, hx, hy, hz FROM hazard_store ORDER BY id""").fetchall()
+                hazards = [((x, y, z), radius, (hx, hy, hz)) for x, y, z, radius, hx, hy, hz in rows]
+            else:
+                hazards = self.read_old(self.conn.cursor())
+            centers, radii, height_vecs = hazards_to_arrays(hazards)
+            low, high = bounding_boxes(centers, radii, height_vecs)
+            with self.index:
+                self.index.execute("""DELETE FROM hazard_index""")
+                self.index.executemany("""INSERT INTO hazard_index VALUES (?, ?, ?, ?, ?, ?, ?)""", [(i, low[i, 0], high[i, 0], low[i, 1], high[i, 1], low[i, 2], high[i, 2]) for i in range(len(hazards))])
+            self.hazards = hazards
+        self.file_version = file_version
+        return True
+
+    def query_box(self, low: tuple, high: tuple) -> np.ndarray:
+        """ Index into hazards of every hazard whose bounding box overlaps the box from low to high. """
+        with self.lock:
+            rows = self.index.execute("""SELECT id FROM hazard_index WHERE max_x >= ? AND min_x <= ? AND max_y >= ? AND min_y <= ? AND max_z >= ? AND min_z <= ?""",
+                                      (float(low[0]), float(high[0]), float(low[1]), float(high[1]), float(low[2]), float(high[2]))).fetchall()
+        return np.array(sorted(row[0] for row in rows), dtype=np.int64)
+
+    def near_segment(self, start: tuple, end: tuple, margin: float) -> np.ndarray:
+        """ Index into hazards of every hazard that might be closer than margin to the segment from start to end. """
+        points = np.asarray([start, end], dtype=float).reshape(-1, 3)
+        return self.query_box(points.min(axis=0) - margin, points.max(axis=0) + margin)
+
+def bounding_boxes(centers: np.ndarray, radii: np.ndarray, height_vecs: np.ndarray) -> tuple:
+    """ Axis aligned bounding box of every cylinder.\n\nReturns (low (H, 3), high (H, 3)). """
+    lengths = np.linalg.norm(height_vecs, axis=-1)
+    axes = height_vecs/lengths[:, None]
+    # How far the end discs reach out along each axis
+    reach = radii[:, None]*np.sqrt(np.maximum(1 - axes**2, 0))
+    ends = np.stack((centers, centers + height_vecs))
+    return ends.min(axis=0) - reach, ends.max(axis=0) + reach
+
+# One store per database file, shared by everything in the process
+stores = {}
+
+def open_store(db_file: str = 'database.db') -> HazardStore:
+    """ Opens the hazard store of db_file, or returns the one already open. """
+    path = os.path.abspath(db_file)
+    if path not in stores:
+        stores[path] = HazardStore(path)
+    return stores[path]
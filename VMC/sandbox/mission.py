@@ -0,0 +1,153 @@
+from collections import deque
+from threading import RLock, Timer
+from loguru import logger
+
+class Step():
+    """ One step of a mission.\n\nkind is 'action' (an FCM action), 'message' (any MQTT message), 'call' (a function) or 'wait'. An action step is done when one of done_events comes in on avr/fcm/events, the other steps are done right away or after delay seconds. """
+    def __init__(self, kind: str, name: str = '', payload: dict = None, done_events: tuple = (), timeout: float = None, delay: float = 0, call=None) -> None:
+        self.kind = kind
+        self.name = name
+        self.payload = {} if payload is None else payload
+        self.done_events = tuple(done_events)
+        self.timeout = timeout
+        self.delay = delay
+        self.call = call
+
+    def __repr__(self) -> str:
+        return f'{self.kind} {self.name}'.strip()
+
+def action(name: str, payload: dict = None, done_events: tuple = None, timeout: float = 15) -> Step:
+    """ FCM action, done on request_<name>_completed_event unless other events are given. """
+    return Step('action', name, payload, (f'request_{name}_completed_event',) if done_events is None else done_events, timeout)
+
+def goto(n: float, e: float, d: float, heading: float = 0, arrive: bool = True, timeout: float = 30) -> Step:
+    """ goto_location_ned, done once the FCM says the drone got there, or just once it started if arrive is False. """
+    return action('goto_location_ned', {'n': n, 'e': e, 'd': d, 'heading': heading}, ('goto_complete_event',) if arrive else ('go_to_started_event',), timeout)
+
+def message(topic: str, payload: dict = None) -> Step:
+    return Step('message', topic, payload)
+
+def call(function, name: str = '') -> Step:
+    return Step('call', name or getattr(function, '__name__', 'call'), call=function)
+
+def wait(seconds: float) -> Step:
+    return Step('wait', f'{seconds}s', delay=seconds)
+
+class MissionExecutor():
+    """ Runs queued missions one step at a time, driven by FCM events and timers.\n\nNothing here blocks, so it is safe to call from MQTT callbacks. A mission is aborted when its action times out, the next queued mission then starts. """
+    def __init__(self, send_action, send_message, busy_retry: float = 0.5) -> None:
+        """ send_action(name, payload) and send_message(topic, payload) publish. busy_retry(seconds) is how long to wait before resending an action the FCM was too busy for. """
+        self.send_action = send_action
+        self.send_message = send_message
+        self.busy_retry = busy_retry
+        # Reentrant so on_done and steps' calls can submit more missions
+        self.lock = RLock()
+        # (name, steps, on_done) of missions waiting to run
+        self.queue = deque()
+        self.mission = None
+        self.steps = deque()
+        self.step = None
+        self.on_done = None
+        # Bumped every time a step starts, so timers of old steps do nothing
+        self.step_id = 0
+        self.timer = None
+
+    @property
+    def busy(self) -> bool:
+        return self.mission is not None
+
+    def submit(self, name: str, steps: list, on_done=None) -> None:
+        """ Queues a mission. on_done(completed: bool) is called when it finishes or is aborted. """
+        with self.lock:
+            self.queue.append((name, list(steps), on_done))
+            if self.mission is None:
+                self.next_mission()
+
+    def abort(self, clear_queue: bool = False) -> None:
+        """ Stops the running mission, and the queued ones too if clear_queue. """
+        with self.lock:
+            if clear_queue:
+                self.queue.clear()
+            if self.mission is not None:
+                self.finish(False)
+
+    def handle_event(self, name: str, payload: str = '') -> None:
+        """ Feeds an avr/fcm/events message to the running step. """
+        with self.lock:
+            step = self.step
+            if step is None or step.kind != 'action':
+                return
+            if name in step.done_events:
+                self.next_step()
+            elif name == 'fcc_busy_event' and payload == step.name:
+                self.start_timer(self.busy_retry, self.retry)
+            elif name == 'action_timeout_event' and payload == step.name:
+                logger.debug(f'Mission {self.mission}: {step} timed out in the FCM')
+                self.finish(False)
+
+    def next_mission(self) -> None:
+        if not self.queue:
+            return
+        self.mission, steps, self.on_done = self.queue.popleft()
+        self.steps = deque(steps)
+        logger.debug(f'Mission {self.mission}: started')
+        self.next_step()
+
+    def next_step(self) -> None:
+        """ Runs steps until one has to wait. """
+        self.cancel_timer()
+        while self.steps:
+            step = self.step = self.steps.popleft()
+            self.step_id += 1
+            logger.debug(f'Mission {self.mission}: {step}')
+            if step.kind == 'action':
+                self.send_action(step.name, step.payload)
+                if step.timeout is not None:
+                    self.start_timer(step.timeout, self.timed_out)
+                return
+            if step.kind == 'message':
+                self.send_message(step.name, step.payload)
+            elif step.kind == 'call':
+                step.call()
+            if step.delay:
+                self.start_timer(step.delay, self.next_step)
+                return
+        self.finish(True)
+
+    def finish(self, completed: bool) -> None:
+        self.cancel_timer()
+        logger.debug(f"Mission {self.mission}: {'done' if completed else 'aborted'}")
+        on_done = self.on_done
+        self.mission, self.step, self.on_done = None, None, None
+        self.steps.clear()
+        if on_done is not None:
+            on_done(completed)
+        self.next_mission()
+
+    def start_timer(self, seconds: float, callback) -> None:
+        self.cancel_timer()
+        step_id = self.step_id
+        self.timer = Timer(seconds, self.fire, (step_id, callback))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def cancel_timer(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def fire(self, step_id: int, callback) -> None:
+        with self.lock:
+            # The step may have moved on while the timer was waiting for the lock
+            if step_id == self.step_id and self.mission is not None:
+                self.timer = None
+                callback()
+
+    def retry(self) -> None:
+        self.send_action(self.step.name, self.step.payload)
+        if self.step.timeout is not None:
+            self.start_timer(self.step.timeout, self.timed_out)
+
+    def timed_out(self) -> None:
+        logger.debug(f'Mission {self.mission}: no reply to {self.step}')
+        self.finish(False)
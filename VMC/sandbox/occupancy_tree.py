@@ -0,0 +1,83 @@
+import numpy as np
+from collision_geometry import hazards_to_arrays, point_cylinder_distance
+
+EMPTY, FULL, MIXED = 0, 1, 2
+
+class OccupancyTree():
+    """ Two level occupancy map of the field built from the hazards.\n\nThe field is split into blocks of block_size**3 fine nodes. Blocks that are all free or all blocked only store that state, mixed blocks also store their fine nodes. """
+    def __init__(self, hazards: list, field_dimensions: tuple, resolution: float, inflate: float, block_size: int = 8) -> None:
+        """ resolution(inches) is the fine node size, inflate(inches) is the drone radius. """
+        self.field_dimensions = np.array(field_dimensions, dtype=float)
+        self.resolution = float(resolution)
+        self.inflate = float(inflate)
+        self.block_size = block_size
+        self.block_length = self.resolution*block_size
+        self.centers, self.radii, self.height_vecs = hazards_to_arrays(hazards)
+        # (x, y, z) counts
+        self.fine_shape = tuple(int(n) for n in np.ceil(self.field_dimensions/self.resolution))
+        self.block_shape = tuple(-(-n//block_size) for n in self.fine_shape)
+        # Indexed [x][y][z], MIXED blocks point into self.fine with self.block_index
+        self.blocks = np.zeros(self.block_shape, dtype=np.uint8)
+        self.block_index = np.full(self.block_shape, -1, dtype=np.int32)
+        self.fine = np.zeros((0, block_size, block_size, block_size), dtype=bool)
+        self.build()
+
+    def distance(self, points: np.ndarray) -> np.ndarray:
+        """ Distance from each point (inches) to the nearest hazard surface. """
+        points = np.asarray(points, dtype=float)
+        if not len(self.radii):
+            return np.full(points.shape[:-1], np.inf)
+        return point_cylinder_distance(points[..., None, :], self.centers, self.radii, self.height_vecs).min(axis=-1)
+
+    def build(self) -> None:
+        """ Classifies every block, then rasterizes only the ones near a hazard surface. """
+        idx = np.stack(np.meshgrid(*[np.arange(n) for n in self.block_shape], indexing='ij'), axis=-1).reshape(-1, 3)
+        if not len(self.radii):
+            return
+        block_centers = (idx + 0.5)*self.block_length
+        half_diagonal = np.sqrt(3)*self.block_length/2
+        # Distance is 1-Lipschitz, so a block whose center is far enough away can not touch that hazard
+        near = point_cylinder_distance(block_centers[:, None], self.centers, self.radii, self.height_vecs) - half_diagonal < self.inflate
+        candidates = near.any(axis=1)
+        idx, near = idx[candidates], near[candidates]
+        offsets = (np.stack(np.meshgrid(*[np.arange(self.block_size)]*3, indexing='ij'), axis=-1) + 0.5)*self.resolution
+        nodes = np.zeros((len(idx),) + (self.block_size,)*3, dtype=bool)
+        for h in range(len(self.radii)):
+            sel = near[:, h]
+            points = (idx[sel]*self.block_length)[:, None, None, None] + offsets
+            nodes[sel] |= point_cylinder_distance(points, self.centers[h], self.radii[h], self.height_vecs[h]) < self.inflate
+        full = nodes.all(axis=(1, 2, 3))
+        mixed = nodes.any(axis=(1, 2, 3)) & ~full
+        self.blocks[tuple(idx[full].T)] = FULL
+        self.blocks[tuple(idx[mixed].T)] = MIXED
+        self.block_index[tuple(idx[mixed].T)] = np.arange(mixed.sum())
+        self.fine = nodes[mixed]
+
+    def occupied(self, points: np.ndarray) -> np.ndarray:
+        """ Whether each point (inches) is in a blocked node. Points outside of the field count as blocked. """
+        points = np.asarray(points, dtype=float)
+        shape = points.shape[:-1]
+        # Flat so single points index the same way
+        node = np.floor(points.reshape(-1, 3)/self.resolution).astype(np.int64)
+        inside = np.all((node >= 0) & (node < self.fine_shape), axis=-1)
+        node = np.where(inside[..., None], node, 0)
+        block = node//self.block_size
+        state = self.blocks[block[..., 0], block[..., 1], block[..., 2]]
+        result = state == FULL
+        mixed = state == MIXED
+        if mixed.any():
+            local = node[mixed] % self.block_size
+            result[mixed] = self.fine[self.block_index[tuple(block[mixed].T)], local[:, 0], local[:, 1], local[:, 2]]
+        return (result | ~inside).reshape(shape)
+
+    def segment_occupied(self, start: tuple, end: tuple) -> bool:
+        """ Whether a straight path from start to end passes through a blocked node. """
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        # Half a node per step so no node along the way is skipped over
+        steps = max(int(np.ceil(np.linalg.norm(end - start)/(self.resolution/2))), 1)
+        return bool(self.occupied(start + np.linspace(0, 1, steps + 1)[:, None]*(end - start)).any())
+
+    def memory(self) -> int:
+        """ Bytes used by the map. """
+        return self.blocks.nbytes + self.block_index.nbytes + self.fine.nbytes
@@ -0,0 +1,205 @@
+import heapq
+import numpy as np
+
+# Face neighbors in 3D grid space (dx, dy, dz)
+SURROUNDING_NODES = (
+    (-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1)
+)
+
+def astar(occupancy: np.ndarray, start: tuple, end: tuple, penalty: np.ndarray = None, stats: dict = None) -> list:
+    """ Heap based A* search over a boolean occupancy grid indexed [z][y][x].\n\nstart and end are (x, y, z) node indices. penalty is an optional extra cost for entering each node, same shape as occupancy. If a stats dict is given, the number of expanded nodes is stored in it under 'expanded'.\n\nReturns a list of node tuples from start to end, or None if no path exists. """
+    nz, ny, nx = occupancy.shape
+    blocked = occupancy.ravel()
+    extra = np.zeros(blocked.size) if penalty is None else np.asarray(penalty, dtype=float).ravel()
+    size = blocked.size
+    layer = nx*ny
+
+    def flat(node):
+        return (node[2]*ny + node[1])*nx + node[0]
+
+    start_i, end_i = flat(start), flat(end)
+    if stats is not None:
+        stats['expanded'] = 0
+    if blocked[end_i]:
+        return None
+    ex, ey, ez = end
+
+    def heuristic(x, y, z):
+        return abs(x - ex) + abs(y - ey) + abs(z - ez) # Grid dist, exact for face moves
+
+    g_score = np.full(size, np.inf)
+    came_from = np.full(size, -1, dtype=np.int64)
+    closed = np.zeros(size, dtype=bool)
+    g_score[start_i] = 0
+    open_set = [(heuristic(*start), 0, start_i)]
+
+    while open_set:
+        # Ties go to the deepest node, g is stored negated for that
+        _, g, current = heapq.heappop(open_set)
+        g = -g
+        if closed[current]:
+            continue
+        if current == end_i:
+            if stats is not None:
+                stats['expanded'] = int(closed.sum()) + 1
+            path = []
+            while current != -1:
+                z, rem = divmod(int(current), layer)
+                y, x = divmod(rem, nx)
+                path.append((x, y, z))
+                current = came_from[current]
+            path.reverse()
+            return path
+        closed[current] = True
+
+        z, rem = divmod(current, layer)
+        y, x = divmod(rem, nx)
+        for dx, dy, dz in SURROUNDING_NODES:
+            nx_, ny_, nz_ = x + dx, y + dy, z + dz
+            if not (0 <= nx_ < nx and 0 <= ny_ < ny and 0 <= nz_ < nz):
+                continue
+            neighbor = (nz_*ny + ny_)*nx + nx_
+            if blocked[neighbor] or closed[neighbor]:
+                continue
+            tentative_g_score = g + 1 + extra[neighbor]
+            if tentative_g_score < g_score[neighbor]:
+                g_score[neighbor] = tentative_g_score
+                came_from[neighbor] = current
+                heapq.heappush(open_set, (tentative_g_score + heuristic(nx_, ny_, nz_), -tentative_g_score, neighbor))
+
+    if stats is not None:
+        stats['expanded'] = int(closed.sum())
+    return None
+
+def remove_colinear(path: list) -> list:
+    """ Drops nodes that lie on a straight run between their neighbors.\n\nReturns a list of tuples. """
+    if len(path) < 3:
+        return list(path)
+    trimmed = [path[0]]
+    for prev, node, nxt in zip(path, path[1:], path[2:]):
+        a, b = np.subtract(node, prev), np.subtract(nxt, node)
+        # Nodes are integers so this is exact
+        if np.any(np.cross(a, b)) or np.dot(a, b) <= 0:
+            trimmed.append(node)
+    trimmed.append(path[-1])
+    return trimmed
+
+# Every neighbor in 3D grid space, diagonals included
+ALL_NEIGHBORS = tuple((dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) != (0, 0, 0))
+
+def line_of_sight(occupancy: np.ndarray, a: tuple, b: tuple) -> bool:
+    """ Walks every node the segment between the centers of nodes a and b passes through.\n\nReturns True if none of them are blocked. """
+    node = list(a)
+    step = [0, 0, 0]
+    t_max = [float('inf')]*3
+    t_delta = [float('inf')]*3
+    for i in range(3):
+        d = b[i] - a[i]
+        if d:
+            step[i] = 1 if d > 0 else -1
+            t_delta[i] = 1/abs(d)
+            # Centers are half a node from the first boundary
+            t_max[i] = t_delta[i]/2
+    for _ in range(sum(abs(b[i] - a[i]) for i in range(3))):
+        i = t_max.index(min(t_max))
+        node[i] += step[i]
+        t_max[i] += t_delta[i]
+        if occupancy[node[2], node[1], node[0]]:
+            return False
+    return True
+
+def theta_star(occupancy: np.ndarray, start: tuple, end: tuple, node_size: tuple = (1, 1, 1), penalty: np.ndarray = None, stats: dict = None, visible=None) -> list:
+    """ Lazy Theta* any-angle search over a boolean occupancy grid indexed [z][y][x].\n\nParents are only kept while they can see the node, so the path is shortcut during the search. penalty is an optional extra cost per unit length near each node, same shape as occupancy. stats works like in astar. visible(a, b) is an optional finer check of the straight leg between the centers of nodes a and b, the grid alone can let a leg clip a hazard between blocked nodes.\n\nReturns the list of turning nodes from start to end, or None if no path exists. """
+    nz, ny, nx = occupancy.shape
+    blocked = occupancy.ravel()
+    extra = np.zeros(blocked.size) if penalty is None else np.asarray(penalty, dtype=float).ravel()
+    size = blocked.size
+    layer = nx*ny
+    sx, sy, sz = node_size
+
+    def flat(node):
+        return (node[2]*ny + node[1])*nx + node[0]
+
+    def unflat(i):
+        z, rem = divmod(int(i), layer)
+        y, x = divmod(rem, nx)
+        return (x, y, z)
+
+    def length(a, b):
+        return (((a[0] - b[0])*sx)**2 + ((a[1] - b[1])*sy)**2 + ((a[2] - b[2])*sz)**2)**0.5
+
+    def cost(a, b):
+        # Penalty is averaged over the two ends of the leg
+        return length(a, b)*(1 + (extra[flat(a)] + extra[flat(b)])/2)
+
+    def sees(a, b):
+        return line_of_sight(occupancy, a, b) and (visible is None or visible(a, b))
+
+    start_i, end_i = flat(start), flat(end)
+    if stats is not None:
+        stats['expanded'] = 0
+    if blocked[end_i]:
+        return None
+
+    def heuristic(node):
+        return length(node, end) # Direct dist
+
+    g_score = np.full(size, np.inf)
+    came_from = np.full(size, -1, dtype=np.int64)
+    closed = np.zeros(size, dtype=bool)
+    g_score[start_i] = 0
+    came_from[start_i] = start_i
+    open_set = [(heuristic(start), start_i)]
+
+    while open_set:
+        _, current = heapq.heappop(open_set)
+        if closed[current]:
+            continue
+        node = unflat(current)
+        parent = int(came_from[current])
+        parent_node = unflat(parent)
+        # Lazy check, only look for a line of sight when the node is expanded
+        if current != start_i and not sees(parent_node, node):
+            best_g, best_parent = np.inf, parent
+            for dx, dy, dz in ALL_NEIGHBORS:
+                neighbor_node = (node[0] + dx, node[1] + dy, node[2] + dz)
+                if not (0 <= neighbor_node[0] < nx and 0 <= neighbor_node[1] < ny and 0 <= neighbor_node[2] < nz):
+                    continue
+                neighbor = flat(neighbor_node)
+                if closed[neighbor] and g_score[neighbor] + cost(neighbor_node, node) < best_g and sees(neighbor_node, node):
+                    best_g, best_parent = g_score[neighbor] + cost(neighbor_node, node), neighbor
+            g_score[current] = best_g
+            came_from[current] = best_parent
+            if best_g == np.inf:
+                # No closed node can see it, it stays open for a later parent
+                continue
+            parent, parent_node = best_parent, unflat(best_parent)
+        if current == end_i:
+            if stats is not None:
+                stats['expanded'] = int(closed.sum()) + 1
+            path = [node]
+            while current != start_i:
+                current = int(came_from[current])
+                path.append(unflat(current))
+            path.reverse()
+            return path
+        closed[current] = True
+
+        parent_g = g_score[parent]
+        for dx, dy, dz in ALL_NEIGHBORS:
+            neighbor_node = (node[0] + dx, node[1] + dy, node[2] + dz)
+            if not (0 <= neighbor_node[0] < nx and 0 <= neighbor_node[1] < ny and 0 <= neighbor_node[2] < nz):
+                continue
+            neighbor = flat(neighbor_node)
+            if blocked[neighbor] or closed[neighbor]:
+                continue
+            # Assume the parent can see the neighbor, checked once it is expanded
+            tentative_g_score = parent_g + cost(parent_node, neighbor_node)
+            if tentative_g_score < g_score[neighbor]:
+                g_score[neighbor] = tentative_g_score
+                came_from[neighbor] = parent
+                heapq.heappush(open_set, (tentative_g_score + heuristic(neighbor_node), neighbor))
+
+    if stats is not None:
+        stats['expanded'] = int(closed.sum())
+    return None
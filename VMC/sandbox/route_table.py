@@ -0,0 +1,111 @@
+import json, logging, sqlite3, os, pathlib, math
+import numpy as np
+from collision_avoidance import collision_dectector
+import field_locations
+
+def route_cost(path: list) -> float:
+    """ Flight distance(inches) along a list of positions. """
+    points = np.asarray(path, dtype=float)
+    return float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+
+def location_clear(col_test: collision_dectector, name: str, pos: tuple) -> bool:
+    """ Checks that the drone fits at a named location, inside the field and clear of every hazard. """
+    _, violation = col_test.validate_route([pos, pos])
+    if violation is not None:
+        logging.error(f'{name} at {pos} is ' + ('out of bounds' if violation[1] is None else f'inside hazard at {violation[1][0]}') + ', fix it in field_locations.py')
+        return False
+    return True
+
+def build_route_table(col_test: collision_dectector, locations: dict) -> dict:
+    """ Plans a route between every ordered pair of named locations.\n\nReturns {(start name, end name): (cost, path)}, cost is inf and path None when there is no route. Locations the drone does not fit at get no routes, and routes that fail validate_route are dropped. """
+    routes = {}
+    usable = {name for name, pos in locations.items() if location_clear(col_test, name, pos)}
+    for start_name, start in locations.items():
+        for end_name, end in locations.items():
+            if start_name == end_name:
+                continue
+            path = col_test.path_find(start, end, any_angle=True) if start_name in usable and end_name in usable else None
+            if path is not None and col_test.validate_route(path)[1] is not None:
+                logging.warning(f'{start_name} -> {end_name}: planned route hits a hazard, dropped')
+                path = None
+            routes[(start_name, end_name)] = (math.inf, None) if path is None else (route_cost(path), path)
+    return routes
+
+def save_route_table(routes: dict, hazard_key: str, db_file: str = 'database.db') -> None:
+    """ Replaces the routes table in database.db. """
+    with sqlite3.connect(db_file) as conn:
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS routes (
+                              start TEXT,
+                              end TEXT,
+                              cost REAL,
+                              path TEXT,
+                              hazard_key TEXT,
+                              PRIMARY KEY (start, end)
+                              )""")
+        c.execute("""DELETE FROM routes""")
+        # SQLite has no infinity literal, unreachable pairs store NULL
+        c.executemany("""INSERT INTO routes VALUES (?, ?, ?, ?, ?)""", [(start, end, None if math.isinf(cost) else cost, json.dumps(path), hazard_key) for (start, end), (cost, path) in routes.items()])
+        conn.commit()
+
+def load_route_table(hazard_key: str = None, db_file: str = 'database.db') -> dict:
+    """ Reads the routes table from database.db.\n\nReturns an empty dict if there is no table, or if it was built for other hazards than hazard_key. """
+    routes = {}
+    with sqlite3.connect(db_file) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name='routes'""")
+        if c.fetchone() is None:
+            return routes
+        c.execute("""SELECT start, end, cost, path, hazard_key FROM routes""")
+        for start, end, cost, path, key in c:
+            if hazard_key is not None and key != hazard_key:
+                logging.warning('Route table is out of date, rerun route_table.py')
+                return {}
+            path = json.loads(path)
+            routes[(start, end)] = (math.inf if cost is None else cost, None if path is None else [tuple(pos) for pos in path])
+    return routes
+
+def best_visit_order(routes: dict, start: str, targets: list, end: str = None) -> tuple:
+    """ Cheapest order to visit every target once, starting at start and finishing at end if given.\n\nExact Held-Karp over the route costs, fine for the handful of buildings on the field. Returns (order, cost), cost is inf if no order works. """
+    targets = list(targets)
+    n = len(targets)
+    def cost(a, b):
+        return routes.get((a, b), (math.inf, None))[0]
+    # best[mask][i]: cheapest cost visiting the targets in mask, ending at target i
+    best = np.full((1 << n, n), math.inf)
+    parent = np.full((1 << n, n), -1, dtype=int)
+    for i, target in enumerate(targets):
+        best[1 << i, i] = cost(start, target)
+    for mask in range(1, 1 << n):
+        for i in range(n):
+            if not mask & (1 << i) or math.isinf(best[mask, i]):
+                continue
+            for j in range(n):
+                if mask & (1 << j):
+                    continue
+                new_cost = best[mask, i] + cost(targets[i], targets[j])
+                if new_cost < best[mask | (1 << j), j]:
+                    best[mask | (1 << j), j] = new_cost
+                    parent[mask | (1 << j), j] = i
+    if not n:
+        return [], 0.0 if end is None else cost(start, end)
+    full = (1 << n) - 1
+    finish = best[full] + (0 if end is None else np.array([cost(target, end) for target in targets]))
+    last = int(finish.argmin())
+    total = float(finish[last])
+    if math.isinf(total):
+        return [], total
+    order = []
+    mask = full
+    while last != -1:
+        order.append(targets[last])
+        mask, last = mask & ~(1 << last), int(parent[mask, last])
+    return order[::-1], total
+
+if __name__ == '__main__':
+    os.chdir(pathlib.Path(__file__).parent.resolve())
+    col_test = collision_dectector(field_locations.FIELD_DIMENSIONS, field_locations.AVR_RAD)
+    routes = build_route_table(col_test, field_locations.named_locations())
+    save_route_table(routes, col_test.hazard_key)
+    for (start, end), (cost, path) in routes.items():
+        print(f'{start} -> {end}: {cost:.1f} in')
@@ -1,13 +1,17 @@
-import json, base64, cv2, time, math, keyboard, sys
-import numpy as np
-from threading import Thread
-from scipy import ndimage
-from scipy.interpolate import interp1d
+import json, time, math, keyboard, sys
 from bell.avr.mqtt.client import MQTTModule
 from bell.avr.mqtt.payloads import *
 from bell.avr.utils import decorators
 from loguru import logger
 from collision_avoidance import collision_dectector
+from trajectory import Trajectory
+from scheduler import Scheduler
+from thermal_frames import FrameRing
+from thermal_detector import ThermalDetector, decode_frame
+from thermal_interp import Upsampler
+from thermal_geolocation import ThermalGeolocator, TargetMap
+from turret_controller import TurretController
+import field_locations, route_table, mission
 
 class Sandbox(MQTTModule):
     def __init__(self) -> None:
@@ -24,11 +28,12 @@ class Sandbox(MQTTModule):
             'avr/vio/position/ned': self.handle_vio_position,
             'avr/sandbox/user_in': self.handle_user_in,
             'avr/fusion/position/ned': self.handle_pos,
+            'avr/fusion/attitude/euler': self.handle_attitude,
             'avr/sanbox/dev': self.handle_dev,
+            'avr/fcm/events': self.handle_fcm_event,
             }
         height_is_75_scale = True
         self.target_range = (30, 40)
-        self.targeting_step = 7
         
         self.pause: bool = False
         self.autonomous: bool = False
@@ -40,44 +45,57 @@ class Sandbox(MQTTModule):
         
         self.do_pathfinding = False
         self.position = [0, 0, 0]
+        # (psi, theta, phi) radians
+        self.attitude = (0, 0, 0)
+        # Pathed flights are streamed as setpoints along a speed limited trajectory
+        self.max_speed = 39.37 # inches/s
+        self.max_accel = 19.685 # inches/s^2
+        self.setpoint_rate = 10 # Hz
+        self.setpoint_lead = 0.5 # seconds the setpoint runs ahead of the trajectory
         
-        self.start_pos = (180, 50, 0)
-        # Only use on homefield firehouse start
-        self.start_pos = (231, 85, 52)
+        self.start_pos = field_locations.START_POS
         
         self.is_armed: bool = False
         self.building_drops: dict  = {'Building 0': False, 'Building 1': False, 'Building 2': False, 'Building 3': False, 'Building 4': False, 'Building 5': False}
-        self.thermal_grid = [[0 for _ in range(8)] for _ in range(8)]
+        # Frames from handle_thermal, targeting keeps the last sequence number it handled
+        self.thermal_frames = FrameRing()
+        self.last_frame = -1
+        self.frame_latency = 0.0
+        self.detector = ThermalDetector()
+        self.upsampler = Upsampler()
         self.sanity = 'Gone'
         self.laser_on = False
         
         self.water_servo_pin = 5
-        self.building_loc = {'Building 0': (404, 120, 55), 'Building 1': (404, 45, 55), 'Building 2': (356, 177, 69), 'Building 3': (356, 53, 69), 'Building 4': (310, 125, 121), 'Building 5': (310, 50, 121)}
-        if height_is_75_scale:
-            for i in range(len(self.building_loc)):
-                self.building_loc[f'Building {i}'] = (self.building_loc[f'Building {i}'][0], self.building_loc[f'Building {i}'][1], self.building_loc[f'Building {i}'][2]*0.75)
+        self.building_loc = field_locations.building_locations(height_is_75_scale)
         
-        self.position = (0, 0, 0)
-        self.landing_pads = {'ground': (180, 50, 12), 'building': (231, 85, 42)}
+        self.position = [0, 0, 0]
+        self.landing_pads = dict(field_locations.LANDING_PADS)
         
-        self.col_test = collision_dectector((472, 170, 200), 17.3622)
-        self.threads: dict
-
-    def set_threads(self, threads):
-        self.threads = threads
+        # Flight sequences run here, stepped by FCM events so no handler has to sleep
+        self.missions = mission.MissionExecutor(self.send_action, self.send_message)
+        
+        self.col_test = collision_dectector(field_locations.FIELD_DIMENSIONS, field_locations.AVR_RAD)
+        # Precomputed by route_table.py, empty if it is missing or the hazards changed since
+        self.routes = route_table.load_route_table(self.col_test.hazard_key)
+        # Where the hotspots seen so far are on the field
+        self.geolocator = ThermalGeolocator(self.col_test)
+        self.fire_map = TargetMap()
+        
+        # Pan and tilt servos, commands are only sent when they change
+        self.turret = TurretController(self.move_servo)
+        # Workers sleep until a handler wakes them
+        self.scheduler = Scheduler()
+        self.scheduler.add('thermal', self.targeting, max_rate=10)
+        self.scheduler.add('cic', self.CIC, max_rate=20)
+        self.scheduler.add('status', self.status, period=0.5)
+        self.scheduler.add('auto', self.Autonomous)
     # ===============
     # Topic Handlers
     def handle_thermal(self, payload: AvrThermalReadingPayload) -> None:
-        data = payload['data']
-        # decode the payload
-        base64Decoded = data.encode("utf-8")
-        asbytes = base64.b64decode(base64Decoded)
-        pixel_ints = list(bytearray(asbytes))
-        k = 0
-        for i in range(len(self.thermal_grid)):
-            for j in range(len(self.thermal_grid[0])):
-                self.thermal_grid[j][i] = pixel_ints[k]
-                k+=1
+        # Copied once, straight from the decoded payload into the ring
+        self.thermal_frames.push(decode_frame(payload['data']))
+        self.scheduler.wake('thermal')
         
     def handle_status(self, payload: AvrFcmStatusPayload) -> None:
         armed = payload['armed']
@@ -88,6 +106,7 @@ class Sandbox(MQTTModule):
     
     def handle_autonomous(self, payload: AvrAutonomousEnablePayload) -> None:
         self.autonomous = payload['enabled']
+        self.scheduler.wake('auto')
         
     def handle_recon(self, payload) -> None:
         self.recon = payload['enabled']
@@ -99,6 +118,7 @@ class Sandbox(MQTTModule):
         self.position = [payload['n'], # X
                          payload['e'], # Y
                          payload['d']] # Z
+        self.scheduler.wake('cic')
         
     def handle_user_in(self, payload) -> None:
         try:
@@ -109,143 +129,196 @@ class Sandbox(MQTTModule):
     def handle_thermal_tracker(self, payload) -> None:
         self.auto_target = payload['enabled']
         if self.auto_target:
-            turret_angles = [1450, 1450]
-            self.send_message(
-                        "avr/pcm/set_servo_abs",
-                        AvrPcmSetServoAbsPayload(servo= 2, absolute= turret_angles[0])
-                    )
-            self.send_message(
-                        "avr/pcm/set_servo_abs",
-                        AvrPcmSetServoAbsPayload(servo= 3, absolute= turret_angles[1])
-                    )
+            self.turret.reset()
+        self.scheduler.wake('thermal')
     
     def handle_thermal_range(self, payload) -> None:
         self.target_range = payload['range'][0:2]
         logger.debug(self.target_range)
-        self.targeting_step = int(payload['range'][2])
+        if len(payload['range']) > 2:
+            # The GUI's targeting step, the old pulse change per frame is closest to microseconds per pixel of error
+            self.turret.set_gains(kp=float(payload['range'][2]))
         
     def handle_pos(self, payload: AvrFusionPositionNedPayload):
         # NOTE Check if direction is based on drone start or global
         self.position[0] = payload['n']
         self.position[1] = payload['e']
         self.position[2] = payload['d']
+        self.scheduler.wake('cic')
+        
+    def handle_attitude(self, payload: AvrFusionAttitudeEulerPayload) -> None:
+        self.attitude = (payload['psi'], payload['theta'], payload['phi'])
+        
+    def handle_fcm_event(self, payload: dict) -> None:
+        self.missions.handle_event(payload['name'], payload.get('payload', ''))
         
     def handle_dev(self, payload):
         if payload == 'test_flight':
-            self.send_message('avr/fcm/capture_home', {}) # Zero NED pos
-            time.sleep(1)
-            self.takeoff()
-            logger.debug('takeoff')
-            time.sleep(4)
-            logger.debug('moving')
-            self.send_action('goto_location_ned', {'n': 1, 'e': 0, 'd': -1, 'heading': 0})
-            time.sleep(1)
+            self.missions.submit('test_flight', [
+                mission.message('avr/fcm/capture_home', {}), # Zero NED pos
+                mission.wait(1),
+                self.takeoff_step(),
+                mission.wait(4),
+                mission.goto(1, 0, -1, arrive=False),
+            ])
         
     # ===============
     # Threads
     def targeting(self) -> None:
-        logger.debug('Thermal Tracking Thread: Online')
-        turret_angles = [1450, 1450]
-        while True:
-            if not self.auto_target:
-                if self.laser_on:
-                    self.set_laser(False)
-                continue
-            if not self.laser_on:
-                self.set_laser(True)
-            img = np.array(self.thermal_grid)
-            lowerb = np.array(self.target_range[0], np.uint8)
-            upperb = np.array(self.target_range[1], np.uint8)
-            mask = cv2.inRange(img, lowerb, upperb)
-            logger.debug(f'\n{mask}')
-            if np.all(np.array(mask) == 0):
-                continue
-            blobs = mask > 100
-            labels, nlabels = ndimage.label(blobs)
-            # find the center of mass of each label
-            t = ndimage.center_of_mass(mask, labels, np.arange(nlabels) + 1 )
-            # calc sum of each label, this gives the number of pixels belonging to the blob
-            s  = ndimage.sum(blobs, labels,  np.arange(nlabels) + 1 )
-            heat_center = [float(x) for x in t[s.argmax()][::-1]]
-            move_range = [15, -15]
-            m = interp1d([0, 8], move_range)
-            move_val = ()
-            logger.debug(heat_center)
-            if heat_center[0] > 4:
-                turret_angles[0] += self.targeting_step
-                self.move_servo(2, turret_angles[0])
-            elif heat_center[0] < 4:
-                turret_angles[0] -= self.targeting_step
-                self.move_servo(2, turret_angles[0])
-            if heat_center[1] < 4:
-                turret_angles[1] += self.targeting_step
-                self.move_servo(3, turret_angles[1])
-            elif heat_center[1] > 4:
-                turret_angles[1] -= self.targeting_step
-                self.move_servo(3, turret_angles[1])
+        """ Run by the scheduler when a thermal frame comes in. Every new frame is aimed at once, oldest first. """
+        seqs, frames, stamps, dropped = self.thermal_frames.read_since(self.last_frame)
+        if len(seqs):
+            self.last_frame = int(seqs[-1])
+        if dropped:
+            logger.debug(f'{dropped} thermal frames dropped')
+        if not self.auto_target:
+            if self.laser_on:
+                self.set_laser(False)
+            return
+        if not self.laser_on:
+            self.set_laser(True)
+        if not len(frames):
+            return
+        lower, upper = self.target_range
+        if len(frames) == 1:
+            center, _ = self.detector.detect(frames[0], lower, upper)
+            centers = [center]
+        else:
+            found, centers, _ = self.detector.detect_batch(frames, lower, upper)
+            centers = [tuple(center) if ok else None for ok, center in zip(found, centers.tolist())]
+        for seq, frame, center, stamp in zip(seqs, frames, centers, stamps):
+            if center is not None:
+                # Hottest point of the blob, to a fraction of a pixel
+                hotspot = self.upsampler.peak(frame, near=center)
+                self.locate_fire(hotspot, stamp)
+                self.aim_turret(hotspot, stamp)
+            self.frame_latency = time.monotonic() - stamp
+            logger.debug(f'Thermal frame {seq}: {self.frame_latency*1000:.1f} ms latency')
+
+    def aim_turret(self, center: tuple, stamp: float) -> None:
+        """ Steers the turret towards center (row, col in thermal pixels) of the frame that came in at stamp. """
+        heat_center = [float(x) for x in center[::-1]]
+        logger.debug(heat_center)
+        self.turret.update(heat_center, stamp)
     
+    def locate_fire(self, hotspot: tuple, stamp: float) -> None:
+        """ Adds where on the field the hotspot (row, col in thermal pixels) is to the fire map. Uses the turret position the frame was taken with. """
+        point = self.geolocator.locate(hotspot, self.turret.pulses(), self.field_position(), self.attitude)
+        if point is not None:
+            self.fire_map.add(point, stamp)
+
     def CIC(self) -> None:
-        logger.debug('CIC Thread: Online')
-        status_thread = Thread(target=self.status)
-        status_thread.daemon = True
-        #status_thread.setDaemon(True)
-        status_thread.start()
-        while True:
-            if not self.CIC_loop:
-                continue
-            if self.position == (42, 42, 42):
-                self.sanity = "Here"
-            else:
-                self.sanity = 'Gone'
+        """ Run by the scheduler on every position update. """
+        if not self.CIC_loop:
+            return
+        if self.position == (42, 42, 42):
+            self.sanity = "Here"
+        else:
+            self.sanity = 'Gone'
 
     def status(self):
+        """ Run by the scheduler every half second. """
         onoff = {True: 'Online', False: 'Offline'}
-        while True:
-            if self.show_status:
-                time.sleep(0.5)
-                self.send_message(
-                    'avr/sandbox/CIC',
-                    {'Thermal Targeting': onoff[self.threads['thermal'].is_alive()], 'CIC': onoff[self.threads['cic'].is_alive()], 'Autonomous': onoff[self.threads['auto'].is_alive()], 'Recon': self.recon, 'Sanity': self.sanity, 'Laser': self.laser_on}
-                )
+        if self.show_status:
+            tasks = self.scheduler.tasks
+            self.send_message(
+                'avr/sandbox/CIC',
+                {'Thermal Targeting': onoff[tasks['thermal'].is_alive()], 'CIC': onoff[tasks['cic'].is_alive()], 'Autonomous': onoff[tasks['auto'].is_alive()], 'Recon': self.recon, 'Sanity': self.sanity, 'Laser': self.laser_on, 'Thermal Latency': round(self.frame_latency*1000, 1), 'Fires': [[round(v) for v in pos] for pos, _ in self.fire_map.targets(time.monotonic())[:3]], 'CPU': self.scheduler.stats()}
+            )
            
     def Autonomous(self):
-        logger.debug('Autonomous Thread: Online')
+        """ Run by the scheduler when autonomous is enabled or disabled. """
         current_building = 1
         found_recon_apriltag = False
         if self.autonomous:            
-            self.takeoff()
-            time.sleep(1)
-            self.land()
-            self.autonomous = False
-            self.send_message(
-            "avr/autonomous/enable", AvrAutonomousEnablePayload(enabled=False)
-            )
+            steps = [self.takeoff_step(), mission.wait(1)]
+            drops = [name for name, enabled in self.building_drops.items() if enabled]
+            if drops:
+                order, cost = route_table.best_visit_order(self.routes, 'Start', drops, 'Start') if self.routes else ([], math.inf)
+                route = self.route_steps(['Start'] + order + ['Start']) if order else None
+                if route is not None:
+                    logger.debug(f'Building order: {order} ({cost:.0f} in)')
+                    steps += route
+                else:
+                    logger.debug(f'No clear route to {drops}, run route_table.py. Buildings skipped.')
+            steps.append(mission.action('land'))
+            self.missions.submit('autonomous', steps, self.autonomous_done)
+        elif self.missions.busy:
+            self.missions.abort(clear_queue=True)
+    
+    def route_steps(self, names: list, hover: float = 1) -> list:
+        """ Mission steps flying the precomputed routes through the named locations in order, hovering hover(seconds) at each.\n\nReturns None if any of the routes is missing or does not pass validate_route. """
+        steps = []
+        for start, end in zip(names, names[1:]):
+            _, path = self.routes.get((start, end), (math.inf, None))
+            if path is None or not self.route_clear(path):
+                logger.debug(f'No clear route from {start} to {end}.')
+                return None
+            for pos in path[1:]:
+                steps.append(mission.goto(*self.field_to_ned(pos)))
+            steps.append(mission.wait(hover))
+        return steps
+    
+    def autonomous_done(self, completed: bool) -> None:
+        self.autonomous = False
+        self.send_message(
+        "avr/autonomous/enable", AvrAutonomousEnablePayload(enabled=False)
+        )
     
     # ===============
     # Drone Control Comands
     def move(self, pos: tuple, pathing: bool = False) -> None:
         """ Moves AVR to postion on field.\n\npos(inches): (x, y, z) """
-        if not pathing or not self.col_test.path_check(self.position, pos):
-            relative_pos = [0, 0, 0]
-            for i in range(3):
-                relative_pos[i] = self.inch_to_m(pos[i]) - self.start_pos[i]
-            relative_pos[2] *= -1
+        if pathing and self.col_test.is_blocked(pos):
+            # Only checked when pathing, the named targets on buildings and pads are meant to be close
+            logger.debug(f'[({pos})] Target too close to a hazard. Movment command canceled.')
+            return
+        if not pathing or not self.col_test.path_check(self.field_position(), pos):
+            relative_pos = self.field_to_ned(pos)
             self.send_action('goto_location_ned', {'n': relative_pos[0], 'e': relative_pos[1], 'd': relative_pos[2], 'heading': 0})
         else:
             # Path obstructed.
             if self.do_pathfinding:
-                # Pathfinding.
-                pathed_positions = self.col_test.path_find(self.position, pos)
-                for p_pos in pathed_positions:
-                    self.move(self.position, p_pos)
-                    time.sleep(.5)
+                # Pathfinding. Replan from where the drone actually is whenever the hazards change,
+                # only the part of the search that changed gets redone.
+                pathed_positions = self.col_test.replan(self.field_position(), pos)
+                while pathed_positions and self.route_clear(pathed_positions) and not self.follow_path(pathed_positions):
+                    pathed_positions = self.col_test.replan(self.field_position(), pos)
+                if pathed_positions is None:
+                    logger.debug(f'[({self.field_position()})->({pos})] No path found. Movment command canceled.')
             else:
                 logger.debug(f'[({self.position})->({pos})] Path obstructed. Movment command canceled.')
                     
     
+    def route_clear(self, path: list) -> bool:
+        """ Checks every leg of a planned path(inches) against the hazards before flying it. """
+        _, violation = self.col_test.validate_route(path)
+        if violation is not None:
+            logger.debug(f'Path leg {violation[0]} obstructed. Movment command canceled.')
+            return False
+        return True
+    
+    def follow_path(self, path: list) -> bool:
+        """ Streams setpoints along a trajectory through path(inches) at setpoint_rate.\n\nReturns False if the hazards changed on the way and the path has to be replanned. """
+        trajectory = Trajectory(path, self.max_speed, self.max_accel)
+        times, positions, _ = trajectory.samples(self.setpoint_rate)
+        lead = int(round(self.setpoint_lead*self.setpoint_rate))
+        start = time.monotonic()
+        for i, t in enumerate(times):
+            # Sleep until the sample is due, not a fixed time, so slow sends do not add up
+            time.sleep(max(start + t - time.monotonic(), 0))
+            if self.col_test.refresh_hazards():
+                return False
+            n, e, d = self.field_to_ned(positions[min(i + lead, len(positions) - 1)])
+            self.send_action('goto_location_ned', {'n': n, 'e': e, 'd': d, 'heading': 0})
+        return True
+
     def takeoff(self, alt = 39.3701) -> None:
         """ AVR Takeoff. \n\nAlt in inches. Defult 1 meter."""
         self.send_action('takeoff', {'alt': round(self.inch_to_m(alt), 4)})
+    def takeoff_step(self, alt = 39.3701) -> mission.Step:
+        """ Takeoff as a mission step, done when the FCM finishes the request. """
+        return mission.action('takeoff', {'alt': round(self.inch_to_m(alt), 4)})
     def land(self) -> None:
         """ AVR Land"""
         #self.move(self.landing_pads[pad])
@@ -276,27 +349,24 @@ class Sandbox(MQTTModule):
     # Misc/Helper
     def inch_to_m(self, num):
         return num/39.37
+    def field_to_ned(self, pos: tuple) -> list:
+        """ Converts a field position (inches) to a NED position (meters from home). """
+        relative_pos = [0, 0, 0]
+        for i in range(3):
+            relative_pos[i] = self.inch_to_m(pos[i] - self.start_pos[i])
+        relative_pos[2] *= -1
+        return relative_pos
+    def field_position(self) -> tuple:
+        """ Converts the NED position (centimeters from home, as fusion and vio publish it) to a field position (inches). """
+        return (self.start_pos[0] + self.position[0]/2.54,
+                self.start_pos[1] + self.position[1]/2.54,
+                self.start_pos[2] - self.position[2]/2.54)
     
 
 if __name__ == '__main__':
     box = Sandbox()
     
-    #Create Threads
-    targeting_thread = Thread(target=box.targeting)
-    targeting_thread.daemon = True
-    #targeting_thread.setDaemon(True)
-    targeting_thread.start()
-    
-    CIC_thread = Thread(target=box.CIC)
-    CIC_thread.daemon = True
-    #CIC_thread.setDaemon(True)
-    CIC_thread.start()
-    
-    autonomous_thread = Thread(target=box.Autonomous)
-    autonomous_thread.daemon = True
-    #autonomous_thread.setDaemon(True)
-    autonomous_thread.start()
-    
-    box.set_threads({'thermal': targeting_thread, 'cic': CIC_thread, 'auto': autonomous_thread})
+    # Worker threads, woken by the topic handlers
+    box.scheduler.start()
     
     box.run()
@@ -0,0 +1,75 @@
+import time
+from threading import Thread, Event, Lock
+from loguru import logger
+
+class Task():
+    """ A worker thread that sleeps until it is woken, instead of polling.\n\nwork is called once per wake up, at most max_rate times a second. Wake ups that come in while it runs or waits for the rate limit are merged into one run. """
+    def __init__(self, name: str, work, max_rate: float = None, period: float = None) -> None:
+        """ period(seconds) also wakes the task on a timer, None only wakes it from wake(). """
+        self.name = name
+        self.work = work
+        self.min_interval = 1/max_rate if max_rate else 0
+        self.period = period
+        self.event = Event()
+        self.runs = 0
+        self.cpu_time = 0.0
+        self.last_run = -float('inf')
+        self.started = None
+        self.thread = Thread(target=self.loop, name=name, daemon=True)
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self.thread.start()
+
+    def wake(self) -> None:
+        self.event.set()
+
+    def is_alive(self) -> bool:
+        return self.thread.is_alive()
+
+    def loop(self) -> None:
+        logger.debug(f'{self.name} Thread: Online')
+        while True:
+            self.event.wait(self.period)
+            # Rate limit, wake ups during the wait are handled by this run
+            time.sleep(max(self.last_run + self.min_interval - time.monotonic(), 0))
+            self.event.clear()
+            self.last_run = time.monotonic()
+            cpu_start = time.thread_time()
+            try:
+                self.work()
+            except Exception:
+                logger.exception(f'{self.name} task failed')
+            self.cpu_time += time.thread_time() - cpu_start
+            self.runs += 1
+
+    def stats(self) -> dict:
+        """ Runs and CPU time (seconds) so far, and the share of one core used since it started. """
+        elapsed = time.monotonic() - self.started if self.started is not None else 0
+        return {'runs': self.runs, 'cpu_time': round(self.cpu_time, 3), 'cpu_percent': round(100*self.cpu_time/elapsed, 2) if elapsed else 0}
+
+class Scheduler():
+    """ Named tasks that the MQTT handlers wake up when they change state. """
+    def __init__(self) -> None:
+        self.tasks = {}
+        self.lock = Lock()
+
+    def add(self, name: str, work, max_rate: float = None, period: float = None) -> Task:
+        task = Task(name, work, max_rate, period)
+        with self.lock:
+            self.tasks[name] = task
+        return task
+
+    def start(self) -> None:
+        for task in self.tasks.values():
+            task.start()
+
+    def wake(self, *names: str) -> None:
+        """ Wakes the named tasks. Names that were never added are ignored, so handlers work before the tasks exist. """
+        for name in names:
+            task = self.tasks.get(name)
+            if task is not None:
+                task.wake()
+
+    def stats(self) -> dict:
+        return {name: task.stats() for name, task in self.tasks.items()}
@@ -0,0 +1,109 @@
+import binascii
+import numpy as np
+
+ROWS, COLS = 8, 8
+SIZE = ROWS*COLS
+
+# A frame mask is kept as a 64 bit int, bit row*8 + col for each pixel.
+# Per row byte lookup tables: pixel count and sum of the pixel columns.
+POPCOUNT = [bin(byte).count('1') for byte in range(256)]
+COL_SUM = [sum(col for col in range(COLS) if byte >> col & 1) for byte in range(256)]
+NOT_FIRST_COL = sum(1 << (row*COLS) for row in range(ROWS)) ^ ((1 << SIZE) - 1)
+NOT_LAST_COL = sum(1 << (row*COLS + COLS - 1) for row in range(ROWS)) ^ ((1 << SIZE) - 1)
+
+def decode_frame(data: str) -> np.ndarray:
+    """ Decodes a base64 thermal reading without copying the pixels again.\n\nPixels come row by row, the frame is returned indexed [column][row] like the rest of the sandbox, as a read only view. """
+    return np.frombuffer(binascii.a2b_base64(data), dtype=np.uint8).reshape(ROWS, COLS).T
+
+def grow(seed: int, mask: int) -> int:
+    """ 4-connected flood fill of mask from the seed bits. """
+    while True:
+        grown = (seed | (seed << COLS) | (seed >> COLS) | ((seed << 1) & NOT_FIRST_COL) | ((seed >> 1) & NOT_LAST_COL)) & mask
+        if grown == seed:
+            return seed
+        seed = grown
+
+def blob_stats(blob: int) -> tuple:
+    """ (pixel count, row sum, column sum) of a blob, a row byte at a time. """
+    count = row_sum = col_sum = 0
+    for row in range(ROWS):
+        byte = blob >> (row*COLS) & 0xFF
+        if byte:
+            n = POPCOUNT[byte]
+            count += n
+            row_sum += row*n
+            col_sum += COL_SUM[byte]
+    return count, row_sum, col_sum
+
+class ThermalDetector():
+    """ Finds the biggest blob of pixels inside a temperature range in 8x8 thermal frames.\n\nBlobs are 4-connected like ndimage.label, ties go to the blob that starts first. One frame is handled as a bit mask with lookup tables, a batch is labelled with NumPy using precomputed neighbor index tables. """
+    def __init__(self) -> None:
+        rows, cols = np.divmod(np.arange(SIZE), COLS)
+        # Each pixel, then its 4 neighbors. Missing neighbors point at the padding slot (SIZE),
+        # which always holds the no blob label.
+        table = np.full((SIZE, 5), SIZE, dtype=np.intp)
+        table[:, 0] = np.arange(SIZE)
+        for k, (dr, dc) in enumerate(((-1, 0), (1, 0), (0, -1), (0, 1)), 1):
+            r, c = rows + dr, cols + dc
+            inside = (r >= 0) & (r < ROWS) & (c >= 0) & (c < COLS)
+            table[inside, k] = r[inside]*COLS + c[inside]
+        self.neighbors = table
+        # (row, col) of every pixel
+        self.coords = np.stack((rows, cols), axis=1).astype(float)
+        self.pixel_index = np.arange(SIZE)
+        # Preallocated mask of one frame, and which of the 256 pixel values are in range
+        self.mask = np.zeros((ROWS, COLS), dtype=bool)
+        self.range = None
+        self.in_range = np.zeros(256, dtype=bool)
+
+    def detect(self, frame: np.ndarray, lower: int, upper: int) -> tuple:
+        """ Biggest blob of pixels from lower to upper (inclusive) in one (8, 8) frame.\n\nReturns (center, size), center is (row, col) or None if no pixel is in range. """
+        if self.range != (lower, upper):
+            self.range = (lower, upper)
+            self.in_range[:] = False
+            self.in_range[max(int(lower), 0):max(int(upper) + 1, 0)] = True
+        np.take(self.in_range, frame, out=self.mask)
+        mask = int.from_bytes(np.packbits(self.mask, bitorder='little').tobytes(), 'little')
+        best = (0, 0, 0)
+        while mask:
+            # Lowest set bit starts the next blob
+            blob = grow(mask & -mask, mask)
+            mask ^= blob
+            stats = blob_stats(blob)
+            if stats[0] > best[0]:
+                best = stats
+        count, row_sum, col_sum = best
+        if not count:
+            return None, 0
+        return (row_sum/count, col_sum/count), count
+
+    def label(self, masks: np.ndarray) -> np.ndarray:
+        """ Labels (N, 64) boolean masks. Every pixel of a blob gets the flat index of the blob's first pixel, pixels outside of blobs get 64. """
+        n = len(masks)
+        labels = np.full((n, SIZE + 1), SIZE, dtype=np.intp)
+        labels[:, :SIZE] = np.where(masks, self.pixel_index, SIZE)
+        batch = np.arange(n)[:, None]
+        while True:
+            # Take the smallest label around each pixel, then jump to the label of that label
+            spread = labels[:, self.neighbors].min(axis=2)
+            spread = np.where(masks, labels[batch, spread], SIZE)
+            if np.array_equal(spread, labels[:, :SIZE]):
+                return spread
+            labels[:, :SIZE] = spread
+
+    def detect_batch(self, frames: np.ndarray, lower: int, upper: int) -> tuple:
+        """ detect for a (N, 8, 8) batch of frames, like the ones buffered in a FrameRing.\n\nReturns (found (N,), centers (N, 2) as (row, col), sizes (N,)). """
+        flat = np.asarray(frames).reshape(-1, SIZE)
+        n = len(flat)
+        labels = self.label((flat >= lower) & (flat <= upper))
+        # Per frame bincounts in one go by offsetting every frame's labels
+        offset = (labels + (np.arange(n)*(SIZE + 1))[:, None]).ravel()
+        sizes = np.bincount(offset, minlength=n*(SIZE + 1)).reshape(n, SIZE + 1)[:, :SIZE]
+        best = sizes.argmax(axis=1)
+        best_sizes = sizes[np.arange(n), best]
+        found = best_sizes > 0
+        # Centroid of the chosen blob only
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centers = ((labels == best[:, None]) @ self.coords)/best_sizes[:, None]
+        centers[~found] = np.nan
+        return found, centers, best_sizes
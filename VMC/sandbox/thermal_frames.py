@@ -0,0 +1,42 @@
+import time
+from threading import Lock
+import numpy as np
+
+class FrameRing():
+    """ Fixed size ring buffer of thermal frames between the MQTT handler and the targeting task.\n\nEvery frame gets the next sequence number and the time it came in. Readers keep the last sequence number they handled, so each frame is handled once, and get copies so the handler can keep writing. """
+    def __init__(self, capacity: int = 16, shape: tuple = (8, 8)) -> None:
+        self.capacity = capacity
+        self.frames = np.zeros((capacity,) + tuple(shape), dtype=np.uint8)
+        self.stamps = np.zeros(capacity)
+        # Sequence number of the next frame, frame seq is in slot seq % capacity
+        self.next_seq = 0
+        self.lock = Lock()
+
+    def push(self, frame: np.ndarray, stamp: float = None) -> int:
+        """ Copies frame into the ring, stamp defaults to now (time.monotonic).\n\nReturns the frame's sequence number. """
+        with self.lock:
+            seq = self.next_seq
+            slot = seq % self.capacity
+            self.frames[slot] = frame
+            self.stamps[slot] = time.monotonic() if stamp is None else stamp
+            self.next_seq += 1
+        return seq
+
+    def read_since(self, last_seq: int) -> tuple:
+        """ Every frame newer than last_seq, oldest first.\n\nReturns (seqs, frames, stamps, dropped). dropped is how many newer frames were overwritten before they were read. """
+        with self.lock:
+            first = max(last_seq + 1, self.next_seq - self.capacity, 0)
+            seqs = np.arange(first, self.next_seq)
+            slots = seqs % self.capacity
+            frames = self.frames[slots]
+            stamps = self.stamps[slots]
+        dropped = first - max(last_seq + 1, 0)
+        return seqs, frames, stamps, dropped
+
+    def latest(self) -> tuple:
+        """ The newest frame, or None if there is none yet.\n\nReturns (seq, frame, stamp). """
+        with self.lock:
+            if not self.next_seq:
+                return None
+            slot = (self.next_seq - 1) % self.capacity
+            return self.next_seq - 1, self.frames[slot].copy(), float(self.stamps[slot])
@@ -0,0 +1,129 @@
+import math
+import numpy as np
+
+def rotation(axis: int, angle: float) -> np.ndarray:
+    """ Rotation matrix of angle(radians) about the x (0), y (1) or z (2) axis. """
+    c, s = math.cos(angle), math.sin(angle)
+    # Cyclic order, so positive angles turn y towards z, z towards x and x towards y
+    i, j = (axis + 1) % 3, (axis + 2) % 3
+    matrix = np.eye(3)
+    matrix[i, i] = matrix[j, j] = c
+    matrix[i, j] = -s
+    matrix[j, i] = s
+    return matrix
+
+class ThermalGeolocator():
+    """ Turns a hotspot in the thermal camera into a point on the field.\n\nThe camera sits on the pan/tilt turret. At the center pulse it looks along the drone's nose, image rows going down and columns going right. Like TurretController, a larger pan pulse turns the camera right and a larger tilt pulse turns it up. The ray through the hotspot is turned by the turret and the drone attitude, then marched through the distance field until it hits a hazard or the floor. """
+    def __init__(self, col_test, fov: float = 60, size: int = 8, center_pulse: int = 1450, degrees_per_us: float = 0.09, offset: tuple = (0, 0, 0)) -> None:
+        """ col_test is the collision_dectector. fov(degrees) is the camera's field of view across size pixels. degrees_per_us is how far a servo turns per microsecond of pulse width. offset(inches) is the camera from the drone center, in the body frame. """
+        self.col_test = col_test
+        self.pixel_angle = math.radians(fov)/size
+        self.image_center = (size - 1)/2
+        self.center_pulse = center_pulse
+        self.radians_per_us = math.radians(degrees_per_us)
+        self.offset = np.asarray(offset, dtype=float)
+
+    def ray(self, pixel: tuple, pulses: tuple, attitude: tuple) -> np.ndarray:
+        """ Unit direction in field axes (x north, y east, z up) through pixel (row, col).\n\npulses are the pan and tilt servo commands. attitude is (psi, theta, phi) in radians as published on avr/fusion/attitude/euler, rotations about the body x, y then z axes. """
+        row, col = pixel
+        # Camera frame: x out of the lens, y right, z down
+        direction = np.array([1.0, math.tan((col - self.image_center)*self.pixel_angle), math.tan((row - self.image_center)*self.pixel_angle)])
+        pan = (pulses[0] - self.center_pulse)*self.radians_per_us
+        tilt = (pulses[1] - self.center_pulse)*self.radians_per_us
+        # Turret then drone, body is forward right down like NED, so a positive turn about y is up
+        body = rotation(2, pan) @ rotation(1, tilt) @ direction
+        ned = self.body_to_ned(attitude) @ body
+        ned /= np.linalg.norm(ned)
+        return np.array([ned[0], ned[1], -ned[2]])
+
+    def body_to_ned(self, attitude: tuple) -> np.ndarray:
+        psi, theta, phi = attitude
+        return rotation(0, psi) @ rotation(1, theta) @ rotation(2, phi)
+
+    def locate(self, pixel: tuple, pulses: tuple, position: tuple, attitude: tuple, max_range: float = 600, tolerance: float = 1) -> np.ndarray:
+        """ Field position(inches) the hotspot at pixel is on, seen from the drone at position(inches).\n\nReturns None if the ray leaves the field first. """
+        offset = self.body_to_ned(attitude) @ self.offset
+        point = np.asarray(position, dtype=float) + np.array([offset[0], offset[1], -offset[2]])
+        direction = self.ray(pixel, pulses, attitude)
+        field = self.col_test.field_dimensions
+        travelled = 0.0
+        # Sphere tracing, the clearance is a safe step towards the nearest hazard
+        while travelled < max_range:
+            if point[2] <= 0 and direction[2] < 0:
+                return np.array([point[0], point[1], 0.0])
+            if np.any(point < 0) or np.any(point > field):
+                return None
+            step = float(self.col_test.distance_field.clearance(point))
+            if step < tolerance:
+                return point
+            if direction[2] < 0:
+                # Never step past the floor
+                step = min(step, max(point[2]/-direction[2], tolerance))
+            point = point + step*direction
+            travelled += step
+        return None
+
+class TargetMap():
+    """ Spatial hash of hot target estimates on the field.\n\nDetections close to a target are averaged into it, weighted by confidence. Confidence decays with a half life, so targets that are not seen again fade out. """
+    def __init__(self, cell_size: float = 12, merge_radius: float = 12, half_life: float = 10, max_confidence: float = 20, forget: float = 0.1) -> None:
+        """ Sizes in inches, half_life in seconds. Targets whose confidence decays below forget are dropped. """
+        self.cell_size = cell_size
+        self.merge_radius = merge_radius
+        self.half_life = half_life
+        self.max_confidence = max_confidence
+        self.forget = forget
+        # (i, j, k) cell -> list of [position, confidence, last update time]
+        self.cells = {}
+
+    def cell(self, pos: np.ndarray) -> tuple:
+        return tuple(int(math.floor(v/self.cell_size)) for v in pos)
+
+    def decayed(self, target: list, now: float) -> float:
+        return target[1]*0.5**(max(now - target[2], 0)/self.half_life)
+
+    def nearest(self, pos: np.ndarray) -> tuple:
+        """ (cell, target) of the closest target within merge_radius, or (None, None). """
+        reach = int(math.ceil(self.merge_radius/self.cell_size))
+        ci, cj, ck = self.cell(pos)
+        best, best_dist = (None, None), self.merge_radius
+        for i in range(ci - reach, ci + reach + 1):
+            for j in range(cj - reach, cj + reach + 1):
+                for k in range(ck - reach, ck + reach + 1):
+                    for target in self.cells.get((i, j, k), ()):
+                        dist = float(np.linalg.norm(target[0] - pos))
+                        if dist <= best_dist:
+                            best, best_dist = ((i, j, k), target), dist
+        return best
+
+    def add(self, pos: tuple, now: float, weight: float = 1) -> list:
+        """ Adds a detection at pos(inches) seen at now(seconds). Returns the target it went into. """
+        pos = np.asarray(pos, dtype=float)
+        cell, target = self.nearest(pos)
+        if target is None:
+            target = [pos, min(weight, self.max_confidence), now]
+            self.cells.setdefault(self.cell(pos), []).append(target)
+            return target
+        confidence = self.decayed(target, now)
+        target[0] = (target[0]*confidence + pos*weight)/(confidence + weight)
+        target[1] = min(confidence + weight, self.max_confidence)
+        target[2] = now
+        new_cell = self.cell(target[0])
+        if new_cell != cell:
+            # The average moved into another cell
+            self.cells[cell] = [other for other in self.cells[cell] if other is not target]
+            if not self.cells[cell]:
+                del self.cells[cell]
+            self.cells.setdefault(new_cell, []).append(target)
+        return target
+
+    def targets(self, now: float, min_confidence: float = 0.5) -> list:
+        """ (position, confidence) of every target above min_confidence, most confident first. """
+        result = []
+        for cell in list(self.cells):
+            kept = [target for target in self.cells[cell] if self.decayed(target, now) >= self.forget]
+            if kept:
+                self.cells[cell] = kept
+            else:
+                del self.cells[cell]
+            result += [(tuple(target[0].tolist()), self.decayed(target, now)) for target in kept if self.decayed(target, now) >= min_confidence]
+        return sorted(result, key=lambda t: -t[1])
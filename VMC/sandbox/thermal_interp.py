@@ -0,0 +1,60 @@
+import numpy as np
+
+# Kept the same as GUI/app/lib/thermal_interp.py, the GUI draws the same upsampled grid.
+
+def cubic_weights(size: int, samples: int) -> np.ndarray:
+    """ (samples, size) matrix of cubic convolution (Catmull-Rom) weights.\n\nRow i interpolates the point i*(size - 1)/(samples - 1) from size evenly spaced values, edges are clamped. """
+    positions = np.linspace(0, size - 1, samples)
+    base = np.floor(positions).astype(int)
+    t = positions - base
+    # Keys kernel with a = -0.5 for the 4 nearest values
+    taps = np.stack((
+        ((-0.5*t + 1)*t - 0.5)*t,
+        (1.5*t - 2.5)*t*t + 1,
+        ((-1.5*t + 2)*t + 0.5)*t,
+        (0.5*t - 0.5)*t*t,
+    ), axis=1)
+    weights = np.zeros((samples, size))
+    for k in range(4):
+        np.add.at(weights, (np.arange(samples), np.clip(base + k - 1, 0, size - 1)), taps[:, k])
+    return weights
+
+class Upsampler():
+    """ Separable cubic upsampling of a thermal grid with precomputed weights, plus sub-pixel peak finding. """
+    def __init__(self, size: int = 8, samples: int = 32) -> None:
+        self.size = size
+        self.samples = samples
+        self.weights = cubic_weights(size, samples)
+        # Original pixels per upsampled step
+        self.step = (size - 1)/(samples - 1)
+        self.positions = np.linspace(0, size - 1, samples)
+
+    def upsample(self, grid: np.ndarray) -> np.ndarray:
+        """ (size, size) grid to (samples, samples), matching the grid exactly at the pixel centers. """
+        return self.weights @ np.asarray(grid, dtype=float) @ self.weights.T
+
+    def peak(self, grid: np.ndarray, near: tuple = None, radius: float = 1.5) -> tuple:
+        """ Sub-pixel (row, col) of the hottest point, in original pixels.\n\nnear limits the search to within radius pixels of a (row, col) point, like the center of a blob. The best upsampled sample is refined with a parabola through its neighbors on each axis. """
+        up = self.upsample(grid)
+        if near is not None:
+            rows = np.abs(self.positions - near[0]) <= radius
+            cols = np.abs(self.positions - near[1]) <= radius
+            if rows.any() and cols.any():
+                up = np.where(rows[:, None] & cols[None, :], up, -np.inf)
+        i, j = np.unravel_index(np.argmax(up), up.shape)
+        return (float(self.positions[i] + self.refine(up, i, j, 0)*self.step),
+                float(self.positions[j] + self.refine(up, i, j, 1)*self.step))
+
+    def refine(self, up: np.ndarray, i: int, j: int, axis: int) -> float:
+        """ Offset (in samples, within half a sample) of a parabola's top through the peak and its two neighbors. """
+        index = (i, j)[axis]
+        if index == 0 or index == up.shape[axis] - 1:
+            return 0.0
+        if axis == 0:
+            left, center, right = up[i - 1, j], up[i, j], up[i + 1, j]
+        else:
+            left, center, right = up[i, j - 1], up[i, j], up[i, j + 1]
+        curve = left - 2*center + right
+        if not np.isfinite(curve) or curve >= 0:
+            return 0.0
+        return float(np.clip(0.5*(left - right)/curve, -0.5, 0.5))
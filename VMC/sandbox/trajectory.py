@@ -0,0 +1,80 @@
+import math
+import numpy as np
+
+def junction_speeds(points: np.ndarray, max_speed: float, max_accel: float, deviation: float) -> np.ndarray:
+    """ Fastest speed the drone can take each waypoint at.\n\nCorners are taken as if cutting an arc that stays within deviation(inches) of the waypoint, so a straight run keeps max_speed and a U-turn stops. The first and last waypoints are stopped at. """
+    speeds = np.zeros(len(points))
+    if len(points) < 3:
+        return speeds
+    incoming = points[1:-1] - points[:-2]
+    outgoing = points[2:] - points[1:-1]
+    incoming /= np.linalg.norm(incoming, axis=1)[:, None]
+    outgoing /= np.linalg.norm(outgoing, axis=1)[:, None]
+    cos_turn = np.clip(np.einsum('ij,ij->i', incoming, outgoing), -1, 1)
+    # Half of the angle between the legs
+    sin_half = np.sqrt((1 + cos_turn)/2)
+    with np.errstate(divide='ignore'):
+        radius = deviation*sin_half/(1 - sin_half)
+    speeds[1:-1] = np.minimum(np.sqrt(max_accel*radius), max_speed)
+    return speeds
+
+class Trajectory():
+    """ Time parameterized flight along a list of waypoints.\n\nEvery leg is a straight line flown with a trapezoid speed profile, limited to max_speed and max_accel. Speeds at the waypoints are as fast as the corners and the distance to slow down in allow. """
+    def __init__(self, waypoints: list, max_speed: float, max_accel: float, deviation: float = 2) -> None:
+        """ waypoints(inches): [(x, y, z), ...]. max_speed(inches/s), max_accel(inches/s^2). """
+        points = np.asarray(waypoints, dtype=float).reshape(-1, 3)
+        # Repeated waypoints would give a leg with no direction
+        keep = np.ones(len(points), dtype=bool)
+        keep[1:] = np.any(np.diff(points, axis=0) != 0, axis=1)
+        self.points = points[keep]
+        self.max_speed = max_speed
+        self.max_accel = max_accel
+        self.lengths = np.linalg.norm(np.diff(self.points, axis=0), axis=1)
+        speeds = junction_speeds(self.points, max_speed, max_accel, deviation)
+        # Forward then backward pass, so every leg can reach the speed at its end
+        for i in range(len(self.lengths)):
+            speeds[i + 1] = min(speeds[i + 1], math.sqrt(speeds[i]**2 + 2*max_accel*self.lengths[i]))
+        for i in reversed(range(len(self.lengths))):
+            speeds[i] = min(speeds[i], math.sqrt(speeds[i + 1]**2 + 2*max_accel*self.lengths[i]))
+        self.speeds = speeds
+        # (start speed, peak speed, end speed, accelerate time, cruise time, decelerate time) per leg
+        self.profiles = [self.leg_profile(self.lengths[i], speeds[i], speeds[i + 1]) for i in range(len(self.lengths))]
+        self.leg_starts = np.concatenate(([0], np.cumsum([sum(profile[3:]) for profile in self.profiles])))
+        self.duration = float(self.leg_starts[-1])
+
+    def leg_profile(self, length: float, start_speed: float, end_speed: float) -> tuple:
+        """ Trapezoid speed profile of one leg, a triangle when it is too short to reach max_speed. """
+        a = self.max_accel
+        peak = min(self.max_speed, math.sqrt(max(a*length + (start_speed**2 + end_speed**2)/2, 0)))
+        accel_dist = (peak**2 - start_speed**2)/(2*a)
+        decel_dist = (peak**2 - end_speed**2)/(2*a)
+        cruise_time = max(length - accel_dist - decel_dist, 0)/peak if peak > 0 else 0
+        return (start_speed, peak, end_speed, (peak - start_speed)/a, cruise_time, (peak - end_speed)/a)
+
+    def sample(self, t: float) -> tuple:
+        """ Position(inches) and velocity(inches/s) at t seconds from the start.\n\nReturns (position, velocity) as NumPy arrays. """
+        if not len(self.lengths):
+            return self.points[0].copy(), np.zeros(3)
+        t = min(max(t, 0), self.duration)
+        leg = min(int(np.searchsorted(self.leg_starts, t, side='right')) - 1, len(self.lengths) - 1)
+        t -= self.leg_starts[leg]
+        start_speed, peak, end_speed, accel_time, cruise_time, decel_time = self.profiles[leg]
+        a = self.max_accel
+        if t < accel_time:
+            dist, speed = start_speed*t + a*t*t/2, start_speed + a*t
+        elif t < accel_time + cruise_time:
+            dist, speed = start_speed*accel_time + a*accel_time**2/2 + peak*(t - accel_time), peak
+        else:
+            t_dec = min(t - accel_time - cruise_time, decel_time)
+            dist = start_speed*accel_time + a*accel_time**2/2 + peak*cruise_time + peak*t_dec - a*t_dec*t_dec/2
+            speed = peak - a*t_dec
+        length = self.lengths[leg]
+        direction = (self.points[leg + 1] - self.points[leg])/length
+        return self.points[leg] + min(dist, length)*direction, speed*direction
+
+    def samples(self, rate: float) -> tuple:
+        """ The trajectory sampled rate times a second, always ending on the last waypoint.\n\nReturns (times (N,), positions (N, 3), velocities (N, 3)). """
+        times = np.arange(0, self.duration, 1/rate)
+        times = np.append(times, self.duration)
+        positions, velocities = zip(*(self.sample(t) for t in times))
+        return times, np.array(positions), np.array(velocities)
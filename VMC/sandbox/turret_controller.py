@@ -0,0 +1,85 @@
+import math
+
+class PID():
+    """ PID controller with a clamped output, anti-windup and a slew limit on the output. """
+    def __init__(self, kp: float, ki: float, kd: float, output_limits: tuple = (-math.inf, math.inf), max_slew: float = math.inf, max_dt: float = 0.5) -> None:
+        """ max_slew is the largest change of the output per second. Gaps between updates longer than max_dt(seconds), like frames with no target, count as max_dt. """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limits = output_limits
+        self.max_slew = max_slew
+        self.max_dt = max_dt
+        self.reset()
+
+    def reset(self, output: float = 0.0) -> None:
+        """ Clears the history. The integral is set so the controller starts out at output. """
+        low, high = self.output_limits
+        self.output = min(max(output, low), high)
+        self.integral = self.output
+        self.last_error = None
+        self.last_time = None
+
+    def update(self, error: float, now: float) -> float:
+        """ Next output for error, measured at now (seconds). """
+        dt = 0.0 if self.last_time is None else min(max(now - self.last_time, 0.0), self.max_dt)
+        derivative = 0.0 if self.last_error is None or not dt else (error - self.last_error)/dt
+        low, high = self.output_limits
+        proportional = self.kp*error
+        integral = self.integral + self.ki*error*dt
+        # Anti-windup, the integral alone may never push the output past its limits
+        integral = min(max(integral, low - min(proportional, 0)), high - max(proportional, 0))
+        output = min(max(proportional + integral + self.kd*derivative, low), high)
+        if self.last_time is not None:
+            step = self.max_slew*dt
+            output = min(max(output, self.output - step), self.output + step)
+        self.integral = integral
+        self.output = output
+        self.last_error = error
+        self.last_time = now
+        return output
+
+class TurretController():
+    """ Keeps the hotspot in the middle of the thermal camera by driving the pan and tilt servos.\n\nError is in thermal pixels, output is the servo pulse width in microseconds. Each servo keeps the last command it sent, so it is only sent again when it changes. """
+    def __init__(self, send, pan_servo: int = 2, tilt_servo: int = 3, center_pulse: int = 1450, pulse_limits: tuple = (700, 2200), kp: float = 10, ki: float = 300, kd: float = 0, max_slew: float = 1500, image_center: float = 3.5) -> None:
+        """ send(servo, pulse) publishes a servo command. Gains are in microseconds per pixel (per second for ki, times seconds for kd), max_slew in microseconds per second. """
+        self.send = send
+        self.servos = (pan_servo, tilt_servo)
+        self.center_pulse = center_pulse
+        self.image_center = image_center
+        limits = (pulse_limits[0] - center_pulse, pulse_limits[1] - center_pulse)
+        self.axes = [PID(kp, ki, kd, limits, max_slew) for _ in self.servos]
+        self.sent = [None, None]
+
+    def set_gains(self, kp: float = None, ki: float = None, kd: float = None) -> None:
+        for pid in self.axes:
+            pid.kp = pid.kp if kp is None else kp
+            pid.ki = pid.ki if ki is None else ki
+            pid.kd = pid.kd if kd is None else kd
+
+    def reset(self) -> None:
+        """ Centers the turret, always sending both servos. """
+        for pid in self.axes:
+            pid.reset()
+        self.sent = [None, None]
+        self.publish()
+
+    def update(self, heat_center: tuple, now: float) -> list:
+        """ Steers towards heat_center (x, y in thermal pixels) seen at now (seconds).\n\nReturns the pulse widths of both servos. """
+        # Pan follows x, tilt turns the other way to y
+        errors = (heat_center[0] - self.image_center, self.image_center - heat_center[1])
+        for pid, error in zip(self.axes, errors):
+            pid.update(error, now)
+        return self.publish()
+
+    def pulses(self) -> list:
+        """ Pulse widths the servos are commanded to. """
+        return [int(round(self.center_pulse + pid.output)) for pid in self.axes]
+
+    def publish(self) -> list:
+        pulses = self.pulses()
+        for i, (servo, pulse) in enumerate(zip(self.servos, pulses)):
+            if pulse != self.sent[i]:
+                self.send(servo, pulse)
+                self.sent[i] = pulse
+        return pulses
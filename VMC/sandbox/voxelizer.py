@@ -0,0 +1,51 @@
+import hashlib, os, glob
+import numpy as np
+from collision_geometry import point_cylinder_distance
+
+CACHE_PREFIX = 'occupancy_'
+
+def hazard_hash(hazards: list, field_dimensions: tuple, grid_shape: tuple, inflate: float) -> str:
+    """ Hash of everything the occupancy grid depends on. Used as the cache key. """
+    key = repr(([tuple(map(float, h[0])) + (float(h[1]),) + tuple(map(float, h[2])) for h in hazards], tuple(map(float, field_dimensions)), tuple(grid_shape), float(inflate)))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def node_centers(field_dimensions: tuple, grid_shape: tuple) -> np.ndarray:
+    """ Field position (inches) of every node center as a (z, y, x, 3) array. """
+    axes = [(np.arange(n) + 0.5)*dim/n for dim, n in zip(field_dimensions, grid_shape)]
+    z, y, x = np.meshgrid(axes[2], axes[1], axes[0], indexing='ij')
+    return np.stack((x, y, z), axis=-1)
+
+def voxelize(hazards: list, field_dimensions: tuple, grid_shape: tuple, inflate: float) -> np.ndarray:
+    """ Rasterizes hazards into a boolean occupancy grid indexed [z][y][x].\n\nA node is blocked when its center is closer than inflate (the drone radius) to a hazard. """
+    centers = node_centers(field_dimensions, grid_shape)
+    occupancy = np.zeros(grid_shape[::-1], dtype=bool)
+    node_size = np.array(field_dimensions, dtype=float)/grid_shape
+    for center, radius, height_vec in hazards:
+        center = np.asarray(center, dtype=float)
+        height_vec = np.asarray(height_vec, dtype=float)
+        # Only test the nodes inside the hazard's inflated bounding box
+        reach = radius + inflate
+        low = np.floor((np.minimum(center, center + height_vec) - reach)/node_size - 0.5).astype(int)
+        high = np.ceil((np.maximum(center, center + height_vec) + reach)/node_size - 0.5).astype(int) + 1
+        low = np.clip(low, 0, grid_shape)
+        high = np.clip(high, 0, grid_shape)
+        box = (slice(low[2], high[2]), slice(low[1], high[1]), slice(low[0], high[0]))
+        occupancy[box] |= point_cylinder_distance(centers[box], center, radius, height_vec) < inflate
+    return occupancy
+
+def cached(prefix: str, key: str, build, directory: str = '.') -> np.ndarray:
+    """ Loads the array saved as <prefix><key>.npy, calling build() and saving its result first if needed.\n\nOther arrays with the same prefix are out of date and get deleted. Returns a read only memory mapped array. """
+    path = os.path.join(directory, f'{prefix}{key}.npy')
+    if not os.path.exists(path):
+        for stale in glob.glob(os.path.join(directory, f'{prefix}*.npy')):
+            os.remove(stale)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, build())
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+def load_or_build(hazards: list, field_dimensions: tuple, grid_shape: tuple, inflate: float, directory: str = '.') -> np.ndarray:
+    """ Loads the cached occupancy grid for these hazards, building and saving it first if needed.\n\nReturns a read only memory mapped array. """
+    key = hazard_hash(hazards, field_dimensions, grid_shape, inflate)
+    return cached(CACHE_PREFIX, key, lambda: voxelize(hazards, field_dimensions, grid_shape, inflate), directory)